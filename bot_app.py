@@ -0,0 +1,1165 @@
+import os
+import re
+import json
+import random
+import asyncio
+from urllib.parse import urlparse, parse_qs
+from aiogram.dispatcher.handler import CancelHandler, SkipHandler
+from pathlib import Path
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.utils import executor
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from dotenv import load_dotenv
+from datetime import datetime, timedelta
+from aiogram.utils.markdown import quote_html
+from aiogram.utils.exceptions import CantInitiateConversation
+from aiogram.bot.api import TelegramAPIServer
+from photo_tools import ultra_obscured_version
+import photo_tools
+from fbi import create_fbi_cases_for_victim, prerender_case_photo, discard_case_photo_prerender
+from store import store, write_json_atomic
+from jobs import jobs
+from file_id_cache import send_photo_cached
+from weapon_index import WeaponIndex
+from moderation import moderation, new_mod_id, mark_decided
+from pending_store import pending_store
+from shared import add_score, set_score as set_player_score
+from leaderboard import leaderboard
+import bot_identity
+import metrics
+import qr_tools
+import photo_cache
+
+
+
+# Подгружаем переменные окружения из .env
+load_dotenv()
+API_TOKEN = os.getenv("API_TOKEN")
+ADMIN_ID = int(os.getenv("ADMIN_ID"))
+CULT_CHANNEL_ID = int(os.getenv("CULT_CHANNEL_ID"))
+CONTROL_CHAT_ID = int(os.getenv("CONTROL_CHAT_ID"))
+FBI_CHANNEL_ID = int(os.getenv("FBI_CHANNEL_ID"))
+
+RITUAL_INTERVAL = 150
+TZ_OFFSET = timedelta(hours=3)
+
+# свой сервер Bot API (или локальная заглушка Telegram для тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+import webhook_mode  # после load_dotenv: настройки читаются при импорте
+from fsm_storage import make_storage
+
+ALLOWED_UPDATES = [
+    "message",
+    "callback_query",
+    "chat_member",
+    "chat_join_request"
+]
+
+if TELEGRAM_API_URL:
+    bot = Bot(token=API_TOKEN, server=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+else:
+    bot = Bot(token=API_TOKEN)
+storage = make_storage()  # FSM_STORAGE=memory|sqlite, см. fsm_storage.py
+dp = Dispatcher(bot, storage=storage)
+dp.middleware.setup(photo_cache.PhotoCacheMiddleware())
+auto_ritual_task = None  # фоновый auto_ritual_loop, живёт от on_startup до on_shutdown
+
+async def on_startup(dp):
+    global auto_ritual_task
+    if webhook_mode.is_webhook():
+        await webhook_mode.register(bot, ALLOWED_UPDATES)
+    else:
+        # снимаем вебхук, чтобы не было конфликта с polling
+        await bot.delete_webhook(drop_pending_updates=True)
+    # профиль бота — один раз, дальше ссылки в ЛС строятся без get_me()
+    await bot_identity.start(bot)
+    # состояние игры — в память, запись на диск в фоне
+    store.start()
+    pending_store.start()
+    weapon_index.weapons()  # строим индекс оружия заранее
+    # фоновые задачи (финализация дел ФБР и т.п.), включая недоделанные до рестарта
+    jobs.start()
+    # отчёты, которые не успели уйти модераторам до рестарта
+    moderation.start(bot, CONTROL_CHAT_ID)
+    # авто-ритуал — в цикле, который реально крутит бот (и в polling, и в вебхуке)
+    if auto_ritual_task is None:
+        auto_ritual_task = asyncio.get_running_loop().create_task(auto_ritual_loop())
+
+async def on_shutdown(dp):
+    global auto_ritual_task
+    task, auto_ritual_task = auto_ritual_task, None
+    if task:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await moderation.flush()
+    await jobs.stop()
+    await bot_identity.stop()
+    await store.stop()
+    qr_tools.shutdown()
+    photo_tools.shutdown_pool()
+
+INVIS_RE = re.compile(r'[\u200B-\u200D\uFEFF]')  # zero-width & BOM
+
+# 👉 Подключаем хендлеры ФБР
+from fbi import register_fbi_handlers
+register_fbi_handlers(dp)
+
+ritual_loop_task = None
+
+
+
+# Пути к данным
+DATA_DIR = Path("data")
+EVENT_FILE = Path("current_event.json")
+REPORT_FILE = Path("ritual_reports.json")
+SCORES_FILE = Path("scores.json")
+PLAYERS_FILE = Path("players.json")
+WEAPONS_FILE = DATA_DIR / "weapons.json"
+IDENTITIES_FILE = Path("data") / "cultist_identities.json"
+MAX_REPORTS = 3
+
+# Флаг работы авто-ритуала
+auto_ritual_active = False
+
+# Загрузка JSON
+
+def load_json(filename):
+    with open(DATA_DIR / filename, encoding="utf-8") as f:
+        return json.load(f)
+
+#def load_reports():
+ #   if REPORT_FILE.exists():
+  #      with open(REPORT_FILE, encoding="utf-8") as f:
+   #         return json.load(f)
+    #return {"victim_id": None, "reports": []}
+
+#def save_reports(data):
+ #   with open(REPORT_FILE, "w", encoding="utf-8") as f:
+  #      json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+WEAPON_ALLOWED = re.compile(r"^[A-Z0-9\-]{2,32}$")
+
+def is_valid_weapon_id(wid: str) -> bool:
+    return bool(WEAPON_ALLOWED.match(wid))
+
+def cult_onboarding_message() -> str:
+    return (
+        "🧭 <b>Как участвовать в ритуале</b>\n"
+        "1) Дождись задания в канале культа (жертва, ритуал, место, оружие).\n"
+        "2) Отправь в ЛС ID оружия: <code>weapon:QW34</code>\n"
+        "   • кириллица не подойдёт: <code>Т≠T</code>, <code>Х≠X</code>\n"
+        "   • можно просто прислать фото QR — я распознаю сам.\n"
+        "3) Пришли <b>одно</b> фото ритуала в ЛС — оно уйдёт на проверку.\n"
+        "⚠️ В группах/канале фото не принимаю — только в личке."
+    )
+
+
+def normalize_weapon_id(text):
+    mapping = {
+        "А":"A","В":"B","С":"C","Е":"E","Н":"H","К":"K","М":"M","О":"O","Р":"P","Т":"T","Х":"X","У":"Y",
+        "Ё":"E","Й":"I","І":"I","Ї":"I"
+    }
+    if not text:
+        return ""
+    # приводим NBSP к обычному пробелу, убираем zero-width
+    text = str(text).replace("\xa0", " ")
+    text = INVIS_RE.sub("", text)
+    # обрезаем края и в верхний регистр
+    text = text.strip().upper()
+    # убираем ВСЕ пробелы внутри (дефисы оставляем)
+    text = text.replace(" ", "")
+    # кириллицу -> латиница
+    return "".join(mapping.get(ch, ch) for ch in text)
+
+# ID оружия → оружие и название → ID; перестраивается при изменении weapons.json
+weapon_index = WeaponIndex(WEAPONS_FILE, normalize_weapon_id)
+
+def safe_get_weapon_id(text):
+    if not text or "weapon:" not in text:
+        return None  # Вместо ошибки возвращаем None
+
+    weapon_id = text.split("weapon:", 1)[-1].strip()
+    if len(weapon_id) < 2:  # Проверяем минимальную длину
+        return None
+
+    return weapon_id
+    
+async def extract_weapon_from_qr(image):
+    """
+    Возвращает weapon_id из QR, если на фото есть:
+      - https://t.me/<bot>?start=weapon-XXXX
+      - tg://resolve?domain=<bot>&start=weapon-XXXX
+      - просто текст 'weapon-XXXX' или 'weapon:XXXX'
+    Иначе None. image — байты картинки (или путь к файлу); само распознавание
+    идёт в пуле qr_tools, не блокируя loop.
+    """
+    try:
+        data = await qr_tools.decode_qr(image)
+        if not data:
+            return None
+
+        txt = data.strip()
+        # Вариант 1: полная ссылка
+        if txt.startswith("http://") or txt.startswith("https://") or txt.startswith("tg://"):
+            try:
+                u = urlparse(txt)
+                qs = parse_qs(u.query)
+                start_vals = qs.get("start") or []
+                if start_vals:
+                    payload = start_vals[0]
+                    # ожидаем weapon-XXXX
+                    if payload.lower().startswith("weapon-"):
+                        code = payload.split("-", 1)[-1]
+                        return normalize_weapon_id(code)
+            except Exception:
+                pass
+
+        # Вариант 2: голый payload
+        low = txt.lower()
+        if low.startswith("weapon-"):
+            return normalize_weapon_id(txt.split("-", 1)[-1])
+        if low.startswith("weapon:"):
+            return normalize_weapon_id(txt.split(":", 1)[-1])
+
+        return None
+    except Exception:
+        return None
+
+
+def load_all_reports():
+    return store.get("reports")
+    
+def load_pending_reports():
+    return pending_store.entries()
+
+def save_all_reports(data):
+    store.set("reports", data)
+
+def load_event():
+    """Текущий ивент или None, если ритуала нет."""
+    return store.get("event")
+
+def save_event(event):
+    store.set("event", event)
+
+def add_report_entry(victim_id: str, victim_data: dict, report: dict):
+    all_reports = load_all_reports()
+    victim_key = str(victim_id)
+
+    if victim_key not in all_reports:
+        all_reports[victim_key] = {
+            "victim_name": victim_data.get("victim_name"),
+            "ritual": victim_data.get("ritual"),
+            "place": victim_data.get("place"),
+            "reports": []
+        }
+    # 👉 новый блок: финальная защита
+    if len(all_reports[victim_key]["reports"]) >= MAX_REPORTS:
+        print(f"[add_report_entry] ⚠️ Лимит отчётов для жертвы {victim_key} достигнут")
+        return False
+        
+    all_reports[victim_key]["reports"].append(report)
+    save_all_reports(all_reports)
+    return True
+
+def load_scores():
+    return store.get("scores")
+
+
+        
+def load_players():
+    return store.get("players")
+
+def save_players(players):
+    store.set("players", players)
+
+def already_in_team(user_id, team=None):
+    players = load_players()
+    current = players.get(str(user_id))
+    if not isinstance(current, dict):
+        return None
+    if team is None:
+        return current
+    return current if current.get("team") == team else None
+
+def assign_team(user_id, team):
+    players = load_players()
+    entry = players.get(str(user_id), {})
+    if not isinstance(entry, dict):
+        entry = {"team": str(entry)} if entry else {}
+    entry["team"] = team
+    players[str(user_id)] = entry
+    save_players(players)
+    leaderboard.update(user_id)
+
+# ==== ОСНОВНАЯ ЛОГИКА ====
+
+async def finalize_victim_job(payload):
+    """Задача очереди: создать дела ФБР по всем принятым отчётам R1..R3 и запостить их."""
+    victim_id = payload["victim_id"]
+    created = await create_fbi_cases_for_victim(victim_id, bot, FBI_CHANNEL_ID)
+    if created:
+        print(f"[FBI] Создано дел по жертве {victim_id}: {created}")
+
+jobs.register("finalize_victim", finalize_victim_job)
+
+async def run_ritual():
+    victims = load_json("victims.json")
+    rituals = load_json("rituals.json")
+    weapons = weapon_index.weapons()
+    places = load_json("places.json")
+
+    auto_ritual_active = True
+    
+    try:
+        with open("used_victims.json", encoding="utf-8") as f:
+            content = f.read().strip()
+            used_ids = json.loads(content) if content else []
+    except FileNotFoundError:
+        used_ids = []
+
+    available_ids = [vid for vid in victims if str(vid) not in used_ids]
+    if not available_ids:
+        await bot.send_message(CULT_CHANNEL_ID, "Все жертвы использованы.")
+        return
+
+    prev_event = load_event()
+    if prev_event and prev_event.get("victim_id") is not None:
+        # дела ФБР по отчётам R1..R3 собираются в фоне — новый ритуал их не ждёт
+        prev_victim_id = prev_event["victim_id"]
+        jobs.enqueue("finalize_victim", prev_victim_id, {"victim_id": prev_victim_id})
+
+    victim_id = random.choice(available_ids)
+    victim = victims[victim_id]
+
+    # Добавляем именно ключ (victim_id), а не victim["id"]
+    used_ids.append(victim_id)
+    write_json_atomic("used_victims.json", used_ids)
+
+    ritual = random.choice(rituals)
+    weapon_entry = random.choice(weapons)
+    weapon = weapon_entry["name"]
+    place = random.choice(places)
+
+    event = {
+        "victim_id": victim_id,
+        "victim_name": victim["name"],
+        "victim_description": victim["description"],
+        "victim_photo": victim["photo"],
+        "ritual": ritual,
+        "weapon": weapon,
+        "place": place,
+        "assigned_weapons": []
+    }
+
+    async with store.locked("event"):
+        save_event(event)
+
+    text = (
+        f"\U0001F52E <b>НОВЫЙ РИТУАЛ</b>\n"
+        f"Жертва: {event['victim_name']} ({event['victim_description']})\n"
+        f"Орудие: {event['weapon']}\n"
+        f"Ритуал: {event['ritual']}\n"
+        f"Место: {event['place']}"
+    )
+
+    # фото жертв не меняются — после первой загрузки шлём по file_id
+    await send_photo_cached(
+        bot,
+        CULT_CHANNEL_ID,
+        event['victim_photo'],
+        caption=text,
+        parse_mode="HTML"
+    )
+
+# ==== РУЧНЫЕ КОМАНДЫ ====
+
+@dp.message_handler(commands=["ритуал"])
+async def start_ritual_loop(message: types.Message):
+    global ritual_loop_task
+
+    if message.from_user.id != ADMIN_ID:
+        return  # Только админ может
+
+    if ritual_loop_task and not ritual_loop_task.done():
+        await message.reply("🔄 Цикл ритуалов уже запущен.")
+        return
+
+    async def auto_ritual_loop():
+        while True:
+            await run_ritual()
+            await asyncio.sleep(RITUAL_INTERVAL)  # 2,5 минут
+
+    ritual_loop_task = asyncio.create_task(auto_ritual_loop())
+    pretty = f"{RITUAL_INTERVAL//60} мин" if RITUAL_INTERVAL % 60 == 0 else f"{RITUAL_INTERVAL} сек"
+    await message.reply(f"🔮 Цикл ритуалов запущен. Каждые {pretty} будет новая жертва.")
+
+@dp.message_handler(commands=["стоп"])
+async def stop_ritual_loop(message: types.Message):
+    global ritual_loop_task
+
+    if message.from_user.id != ADMIN_ID:
+        return  # Только админ может
+
+    if not ritual_loop_task or ritual_loop_task.done():
+        await message.reply("⛔ Цикл ритуалов уже остановлен.")
+        return
+
+    ritual_loop_task.cancel()
+    ritual_loop_task = None
+    await message.reply("🛑 Цикл ритуалов остановлен.")
+
+
+def render_fbi_top(top):
+    lines = ["🏆 <b>Топ-10 ФБР</b>:"]
+    for i, (uid, sc) in enumerate(top, 1):
+        mention = f"<a href='tg://user?id={uid}'>Агент</a>"
+        lines.append(f"{i}. {mention}: {sc}")
+    return "\n".join(lines)
+
+
+def render_cult_top(top):
+    text = "🏆 <b>Топ-10 культистов</b>:\n"
+    for i, (uid, score) in enumerate(top, 1):
+        mention = f"<a href='tg://user?id={uid}'>Культист</a>"
+        text += f"{i}. {mention}: {score} очков\n"
+    return text
+
+
+@dp.message_handler(commands=["очки"])
+async def show_scores(message: types.Message):
+    scores = load_scores()
+    user_id = str(message.from_user.id)
+
+    # Если пусто — быстрое сообщение и выход
+    if not scores:
+        if message.chat.id == FBI_CHANNEL_ID:
+            await message.reply("Пока ни у кого из ФБР нет очков.")
+        else:
+            await message.reply("Пока никто не пролил кровь.")
+        return
+
+    # === Режим ФБР-канала ===
+    if message.chat.id == FBI_CHANNEL_ID:
+        # Мои очки и место среди агентов ФБР
+        board = leaderboard.board("fbi")
+        my_score = scores.get(user_id, 0)
+        my_rank = board.rank(user_id)
+
+        if not len(board):
+            await message.reply(
+                f"🕵️ Твои очки: {my_score}\n"
+                f"Пока нет рейтинга среди ФБР.", parse_mode="HTML"
+            )
+            return
+
+        # Топ берём готовым из кэша доски, строку «мои очки» — под каждого
+        my_line = f"🕵️ <b>Твои очки:</b> {my_score}" + (f" (место {my_rank})" if my_rank else "")
+        text = my_line + "\n" + board.rendered(render_fbi_top)
+
+        await message.reply(text, parse_mode="HTML")
+        return
+
+    # === Обычный режим (например, канал культа) — рейтинг культа ===
+    board = leaderboard.board("cult")
+    text = board.rendered(render_cult_top)
+    my_rank = board.rank(user_id)
+    if my_rank:
+        text += f"\nТвоё место: {my_rank}"
+
+    await message.reply(text, parse_mode="HTML")
+
+
+# ==== ФОНОВАЯ ЗАДАЧА ====
+
+async def auto_ritual_loop():
+    global auto_ritual_active
+    while True:
+        if auto_ritual_active:
+            try:
+                await run_ritual()
+            except Exception as e:
+                print(f"⚠️ Ошибка в авто-ритуале: {e}")
+        await asyncio.sleep(15)
+        
+# ==== ПРИЁМ QR С ОРУЖИЕМ (фото в ЛС) ====
+@dp.message_handler(lambda m: m.chat.type == "private", content_types=types.ContentType.PHOTO)
+async def handle_weapon_qr_photo(message: types.Message):
+    # Скачиваем фото в память (один раз на апдейт) и распознаём прямо из буфера
+    image_bytes = await photo_cache.get_photo_bytes(message.photo[-1])
+
+    wid = await extract_weapon_from_qr(image_bytes)
+
+    if not wid:
+        # Дай пройти следующему хендлеру (handle_report) — байты он возьмёт из кэша
+        raise SkipHandler()
+
+    # Нашли weapon_id — валидируем и проводим через общий пайплайн
+    if not is_valid_weapon_id(wid):
+        await message.reply("❌ Некорректный ID в QR. Разрешены A–Z, 0–9 и «-», длина 2–32.")
+        # Останавливаем дальнейшие хендлеры, чтобы это фото не ушло как отчёт
+        raise CancelHandler()
+
+    await process_weapon_submission(message, wid)
+    # Останавливаем дальнейшие хендлеры (иначе это фото попадёт в модерацию как отчёт)
+    raise CancelHandler()
+# ==== ПРИЁМ ОТЧЁТОВ ====
+
+@dp.message_handler(content_types=types.ContentType.PHOTO)
+async def handle_report(message: types.Message):
+    user_id = message.from_user.id
+    username = message.from_user.username or f"id:{user_id}"
+
+    # ✅ Теперь отчёты принимаем только в личке
+    if message.chat.type != "private":
+        # мягко подскажем, что делать правильно
+        await message.reply("⛔ Фото-отчёт присылай **мне в личку**. В канал попадает только принятый отчёт.")
+        return
+    event = load_event()
+    if not event:
+        await message.reply("❌ Сейчас нет активного ритуала.")
+        print(f"[DEBUG] ❌ Активный ритуал ({EVENT_FILE}) не найден.")
+        return
+
+
+
+    
+    # Проверка: присылал ли пользователь weapon_id
+    assigned_weapons = event.get("assigned_weapons", [])
+    user_weapon = next((w for w in assigned_weapons if w["user_id"] == user_id), None)
+
+    if not user_weapon:
+        try:
+            await message.reply(
+                "⛔ Сначала укажи ID оружия.\n\n"
+                "1) Отправь в ЛС сообщение: <code>weapon:QW34</code>\n"
+                "   • кириллица не подойдёт: <code>Т≠T</code>, <code>Х≠X</code>\n"
+                "2) Или пришли фото QR с кодом — я распознаю его сам.\n\n"
+                f"👉 Если диалог закрыт: <a href='{bot_identity.deeplink()}'>открыть ЛС со мной</a>",
+                parse_mode="HTML"
+            )
+        except Exception:
+            await message.reply(
+                "⛔ Сначала укажи ID оружия: <code>weapon:QW34</code>\n"
+                "Или пришли фото QR — я вытащу код сам.",
+                parse_mode="HTML"
+            )
+        print(f"[DEBUG] ⛔ Отчёт отклонён — не указан weapon_id от {username}")
+        return
+
+    if pending_store.exists(user_id, event["victim_id"]):
+        await message.reply(f"⛔ @{username}, ты уже отправлял отчёт. Ожидается проверка.")
+        print(f"[DEBUG] ⛔ Повторный отчёт от {username}")
+        return
+
+    weapon_name = None
+    try:
+        matched = weapon_index.by_id(user_weapon["weapon_id"])
+        weapon_name = matched.get("name") if matched else None
+
+        if not matched:
+            print(f"[DEBUG] ❌ Оружие с ID {user_weapon['weapon_id']} не найдено в списке weapons.")
+        else:
+            print(f"[DEBUG] ✅ Найдено оружие: {weapon_name}")
+    except Exception as e:
+        print(f"[DEBUG] ⚠️ Не удалось загрузить weapon_name: {e}")
+
+    all_reports = load_all_reports()
+    victim_key = str(event["victim_id"])
+    # 👉 новый блок: лимит уже принятых отчётов
+    if victim_key in all_reports and len(all_reports[victim_key]["reports"]) >= MAX_REPORTS:
+        await message.reply("⛔ Лимит отчётов по этой жертве достигнут. Дело закрыто.")
+        print(f"[DEBUG] ⛔ Лимит отчётов для {victim_key} достигнут")
+        return
+        
+    if victim_key in all_reports:
+        if any(r.get("user_id") == user_id for r in all_reports[victim_key]["reports"]):
+            await message.reply("⛔ Ты уже присылал отчёт по этому ритуалу.")
+            print(f"[DEBUG] ⛔ {username} уже сдавал отчёт по жертве {victim_key}")
+            return
+
+    photo = message.photo[-1]
+    filename = f"ritual_{event['victim_id']}_{user_id}.jpg"
+    os.makedirs("reports", exist_ok=True)
+    destination = Path("reports") / filename
+    # если QR-хендлер уже скачал это фото — байты придут из кэша апдейта
+    destination.write_bytes(await photo_cache.get_photo_bytes(photo))
+    print(f"[DEBUG] Фото сохранено: {destination}")
+
+    # Сохраняем отчёт в pending сразу: mod_id выдаём сами, кнопки уходят
+    # вместе с фото, message_id допишется после отправки
+    entry = {
+        "mod_id": new_mod_id(),
+        "user_id": user_id,
+        "username": username,
+        "weapon_id": user_weapon["weapon_id"],
+        "weapon": weapon_name,  # Название оружия
+        "victim_id": event["victim_id"],
+        "victim_name": event.get("victim_name"),
+        "ritual": event.get("ritual"),
+        "place": event.get("place"),
+        "photo_file": photo.file_id,
+        "photo_path": str(destination),
+        "message_id": None
+    }
+    async with store.locked("pending"):
+        added = pending_store.add(entry)
+    if not added:
+        # второй отчёт успел проскочить, пока скачивалось фото
+        await message.reply(f"⛔ @{username}, ты уже отправлял отчёт. Ожидается проверка.")
+        print(f"[DEBUG] ⛔ Повторный отчёт от {username}")
+        return
+
+    await message.reply("📸 Отчёт отправлен на проверку. Ожидай подтверждения.")
+
+    try:
+        await moderation.submit(entry)
+    except Exception as e:
+        print(f"[ERROR] ❌ Ошибка отправки фото на проверку: {e}")
+        async with store.locked("pending"):
+            pending_store.remove(entry["mod_id"])
+        await message.reply("⚠️ Ошибка при отправке на проверку.")
+        return
+
+
+# ==== ОБРАБОТКА КНОПОК ====
+
+
+@dp.callback_query_handler(lambda c: c.data.startswith("accept") or c.data.startswith("reject"))
+async def process_callback(call: CallbackQuery):
+    action, mod_key = call.data.split(":")
+
+    # Проверка и запись — под замками pending/отчётов/очков, чтобы два модератора
+    # не обработали один отчёт дважды. Все сетевые вызовы — уже после.
+    limit_reached = False
+    async with store.locked("scores", "reports", "pending"):
+        entry = pending_store.get(mod_key)
+
+        if entry and action == "accept":
+            victim_id = entry.get("victim_id")
+
+            # identity_id, даже если в ФБР
+            players = load_players()
+            player = players.get(str(entry["user_id"]), {})
+            identity_id = player.get("identity_id")
+
+            # готовим отчёт
+            photo_file_id = call.message.photo[-1].file_id if call.message.photo else entry.get("photo_file")
+            timestamp = (datetime.utcnow() + TZ_OFFSET).isoformat()
+            report_entry = {
+                "user_id": entry["user_id"],
+                "identity_id": identity_id,
+                "weapon_id": entry.get("weapon_id"),
+                "weapon_name": entry.get("weapon"),
+                "photo_file_id": photo_file_id,
+                "timestamp": timestamp
+            }
+
+            # запись в базу (внутри — проверка лимита)
+            ok = add_report_entry(victim_id, {
+                "victim_name": entry.get("victim_name"),
+                "ritual": entry.get("ritual"),
+                "place": entry.get("place")
+            }, report_entry)
+
+            if ok:
+                # успех -> удаляем из pending
+                pending_store.remove(mod_key)
+
+                # начисляем очки
+                new_score = add_score(entry["user_id"], 1)
+            else:
+                limit_reached = True
+
+        elif entry and action == "reject":
+            pending_store.remove(mod_key)
+
+    if not entry:
+        await call.answer("⛔ Отчёт уже обработан.", show_alert=True)
+        return
+    if limit_reached:
+        await call.answer("⛔ Лимит отчётов по этой жертве уже достигнут.", show_alert=True)
+        return
+
+    user_id = entry["user_id"]
+    username = entry["username"]
+
+    if action == "accept":
+        ritual = entry.get("ritual")
+        place = entry.get("place")
+        weapon_name = entry.get("weapon")
+        weapon_id = entry.get("weapon_id")
+
+        # искажённую картинку для будущего дела ФБР начинаем готовить уже сейчас
+        report_photo = Path("reports") / f"ritual_{entry.get('victim_id')}_{user_id}.jpg"
+        if report_photo.exists():
+            prerender_case_photo(report_photo)
+
+        # отмечаем решение в контрол-чате (подпись фото или строка в пакете)
+        await mark_decided(call.message, mod_key, f"✅ Очки начислены ({new_score})")
+        await bot.send_message(CULT_CHANNEL_ID, f"✅ @{username}, отчёт принят. У него {new_score} очков.")
+
+        # ✅ Дублируем подтверждение в личку автору отчёта
+        try:
+            await bot.send_message(
+                user_id,
+                (
+                    "✅ Твой отчёт принят!\n"
+                    f"Жертва: {entry.get('victim_name')}\n"
+                    f"Ритуал: {ritual}\n"
+                    f"Орудие: {weapon_name or weapon_id}\n"
+                    f"Место: {place}\n\n"
+                    "🏅 Начислено: +1 очко\n"
+                    f"💰 Твой счёт: {new_score}\n\n"
+                    "Следи за каналом культа — новое задание уже близко."
+                )
+            )
+        except Exception as e:
+            print(f"[DEBUG] ❌ Не удалось отправить подтверждение в личку: {e}")
+        # ✅ Публикуем принятую фотографию в канал культа
+        try:
+            # берём то же фото, которое пришло на модерацию
+            final_caption = (
+                f"🧾 Принятый отчёт от @{username}\n"
+                f"Жертва: {entry.get('victim_name')}\n"
+                f"Ритуал: {ritual}\n"
+                f"Орудие: {weapon_name or weapon_id}\n"
+                f"Место: {place}"
+            )
+            # в контрол-чате у нас есть объект с фото; безопаснее переслать по file_id
+            # в пакетном режиме кнопки в отдельном сообщении — берём file_id из отчёта
+            file_id = call.message.photo[-1].file_id if call.message.photo else entry.get("photo_file")
+            if file_id:
+                await bot.send_photo(CULT_CHANNEL_ID, photo=file_id, caption=final_caption)
+            else:
+                # fallback, если вдруг нет photo в самом сообщении (редкий случай)
+                await bot.send_message(CULT_CHANNEL_ID, final_caption)
+        except Exception as e:
+            print(f"[DEBUG] ⚠️ Не удалось опубликовать фото в канал культа: {e}")
+
+    elif action == "reject":
+        # если искажённое фото уже успели подготовить — оно больше не нужно
+        discard_case_photo_prerender(Path("reports") / f"ritual_{entry.get('victim_id')}_{user_id}.jpg")
+        try:
+            await mark_decided(call.message, mod_key, "❌ Отчёт отклонён")
+        except Exception as e:
+            print(f"[DEBUG] ❌ Не удалось обновить caption: {e}")
+
+        # Уведомим игрока
+        try:
+            await bot.send_message(user_id, "❌ Ритуал не принят. Дерево отвергло твоё подношение.")
+        except Exception as e:
+            print(f"[DEBUG] ❌ Не удалось отправить личное сообщение: {e}")
+
+        await call.answer("❌ Отчёт отклонён.")
+
+        
+
+
+#Вступление в команду
+# Исправленная логика вступления в ФБР
+@dp.callback_query_handler(lambda c: c.data in ["join_cult", "join_fbi"])
+async def handle_team_selection(call: types.CallbackQuery):
+    user_id = call.from_user.id
+    username = call.from_user.username or f"id:{user_id}"
+    players = load_players()
+
+    # Проверяем текущее состояние игрока
+    current_player = players.get(str(user_id))
+
+    if call.data == "join_cult":
+        # Если игрок уже в ФБР — отклонить
+        if current_player and isinstance(current_player, dict) and current_player.get("team") == "fbi":
+            await call.message.edit_text("❌ Ты уже в ФБР. Культ отвергает тебя.")
+            return
+
+        # Если уже в культе - проверяем участие в канале
+        if current_player and isinstance(current_player, dict) and current_player.get("team") == "cult":
+            try:
+                member = await bot.get_chat_member(CULT_CHANNEL_ID, user_id)
+                if member.status not in ("left", "kicked"):
+                    await call.message.edit_text("⛔ Ты уже в культе.")
+                    return
+                else:
+                    # Вышел — разрешим повторное вступление
+                    pass
+            except Exception as e:
+                await bot.send_message(ADMIN_ID, f"⚠️ Ошибка проверки участника: {e}")
+                await call.message.edit_text("Произошла ошибка при проверке. Обратись к администратору.")
+                return
+
+        # Назначаем личность культисту
+        try:
+            with open(IDENTITIES_FILE, encoding="utf-8") as f:
+                identities = json.load(f)
+        except Exception as e:
+            await bot.send_message(ADMIN_ID, f"⚠️ Ошибка загрузки cultist_identities.json: {e}")
+            await call.message.edit_text("❌ Что-то пошло не так. Обряд прервали.")
+            return
+
+        identity = random.choice(identities)
+
+        async with store.locked("players"):
+            players = load_players()
+            players[str(user_id)] = {
+                "team": "cult",
+                "identity_id": identity["id"]
+            }
+            save_players(players)
+            leaderboard.update(user_id)
+
+        # Генерируем инвайт
+        try:
+            invite = await bot.create_chat_invite_link(chat_id=CULT_CHANNEL_ID, member_limit=1, creates_join_request=False)
+            invite_link = invite.invite_link
+        except Exception as e:
+            await bot.send_message(ADMIN_ID, f"⚠️ Ошибка создания инвайта: {e}")
+            invite_link = "Ошибка создания ссылки"
+
+        text = (
+            f"🔮 <b>Ты теперь часть нас</b>\n"
+            f"<b>Твоя личность:</b> {identity['name']} {identity['mask_symbol']}\n"
+            f"<i>{identity['description']}</i>\n\n"
+            f"Запомни: ты — маска, а не человек. Носи её. И не говори вслух своё имя.\n\n"
+            f"➡️ Вступи в культ: {invite_link}"
+        )
+        await call.message.edit_text(text, parse_mode="HTML")
+        # ➕ Отправляем новичку пошаговую инструкцию в ЛС
+        try:
+            await bot.send_message(
+                user_id,
+                cult_onboarding_message(),
+                parse_mode="HTML",
+                disable_web_page_preview=True
+            )
+        except CantInitiateConversation:
+            # если ЛС закрыт — дадим ссылку-напоминание прямо там, где он нажал кнопку
+            try:
+                await call.message.answer(
+                    "ℹ️ Открой личку со мной, чтобы получить инструкции: "
+                    f"<a href='{bot_identity.deeplink()}'>перейти в ЛС</a>",
+                    parse_mode="HTML", disable_web_page_preview=True
+                )
+            except Exception:
+                pass
+
+    else:  # join_fbi
+        # ИСПРАВЛЕННАЯ ЛОГИКА ДЛЯ ФБР
+
+        # Проверяем, состоит ли уже в ФБР
+        if current_player and isinstance(current_player, dict) and current_player.get("team") == "fbi":
+            await call.message.edit_text("⛔ Ты уже в ФБР.")
+            return
+
+        # Если игрок был в культе - применяем штраф
+        if current_player and isinstance(current_player, dict) and current_player.get("team") == "cult":
+            print(f"[DEBUG] Пользователь {username} был в культе, применяем штраф")
+
+            # Минус 10 очков за предательство
+            async with store.locked("scores"):
+                current_score = load_scores().get(str(user_id), 0)
+                new_score = add_score(user_id, -10)
+
+            print(f"[DEBUG] Счет изменен: {current_score} -> {new_score}")
+
+            # 50% шанс, что культ узнает
+            if random.random() < 0.5:
+                try:
+                    await bot.send_message(
+                        CULT_CHANNEL_ID,
+                        f"😈 @{username} пал ниц и попытался сбежать в ФБР. Культ помнит предателей..."
+                    )
+                    print(f"[DEBUG] Сообщение о предательстве отправлено в культ")
+                except Exception as e:
+                    print(f"[DEBUG] Ошибка отправки в культ: {e}")
+                    await bot.send_message(ADMIN_ID, f"⚠️ Ошибка отправки в канал культа: {e}")
+
+            # Отправляем сообщение предателю
+            try:
+                await bot.send_message(
+                    user_id,
+                    f"❌ Ты был в культе, но ФБР приняло тебя.\n"
+                    f"🔻 Штраф за предательство: -10 очков\n"
+                    f"💰 Твой счет теперь: {new_score}"
+                )
+                print(f"[DEBUG] Сообщение о штрафе отправлено пользователю {user_id}")
+            except Exception as e:
+                print(f"[DEBUG] Ошибка отправки личного сообщения: {e}")
+                # Если не удалось отправить в личку, показываем в интерфейсе
+                penalty_text = f"❌ Штраф за предательство: -10 очков. Счет: {new_score}\n\n"
+            else:
+                penalty_text = ""
+        else:
+            penalty_text = ""
+
+        # Переводим в команду ФБР
+        async with store.locked("players"):
+            players = load_players()
+            curr = players.get(str(user_id), {})
+            players[str(user_id)] = {**curr, "team": "fbi"}
+            save_players(players)
+            leaderboard.update(user_id)
+        
+
+        # Создаем инвайт в ФБР
+        try:
+            invite = await bot.create_chat_invite_link(chat_id=FBI_CHANNEL_ID, member_limit=1, creates_join_request=False)
+            invite_link = invite.invite_link
+        except Exception as e:
+            await bot.send_message(ADMIN_ID, f"⚠️ Ошибка создания инвайта ФБР: {e}")
+            invite_link = "Ошибка создания ссылки"
+
+        response_text = (
+            f"{penalty_text}"
+            f"🕵️ Добро пожаловать в ФБР. Улики не ждут.\n"
+            f"➡️ {invite_link}"
+        )
+
+        await call.message.edit_text(response_text)
+        print(f"[DEBUG] Обработка вступления в ФБР завершена для {username}")
+
+# Дополнительная команда для отладки очков
+@dp.message_handler(commands=["debug_score"])
+async def debug_score(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    user_id = message.from_user.id
+    scores = load_scores()
+    players = load_players()
+
+    debug_info = f"""
+🔍 Отладочная информация:
+User ID: {user_id}
+Текущие очки: {scores.get(str(user_id), 0)}
+Команда: {players.get(str(user_id), "Не назначена")}
+
+Все очки: {scores}
+Все игроки: {players}
+    """
+
+    await message.reply(debug_info)
+
+# Метрики процесса (очередь QR, тайминги и т.п.)
+@dp.message_handler(commands=["metrics"])
+async def show_metrics(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    await message.reply(metrics.render())
+
+# Команда для принудительного изменения очков (для отладки)
+@dp.message_handler(commands=["set_score"])
+async def set_score(message: types.Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+
+    try:
+        parts = message.text.split()
+        if len(parts) < 3:
+            await message.reply("Использование: /set_score <user_id> <очки>")
+            return
+
+        target_user_id = parts[1]
+        new_score = int(parts[2])
+
+        async with store.locked("scores"):
+            set_player_score(target_user_id, new_score)
+
+        await message.reply(f"✅ Установлены очки {new_score} для пользователя {target_user_id}")
+
+    except Exception as e:
+        await message.reply(f"❌ Ошибка: {e}")
+
+# Функция для безопасной отправки личных сообщений
+async def safe_send_private_message(user_id, text):
+    """Безопасная отправка личного сообщения с обработкой ошибок"""
+    try:
+        await bot.send_message(user_id, text)
+        return True
+    except Exception as e:
+        print(f"[DEBUG] Не удалось отправить сообщение пользователю {user_id}: {e}")
+        return False
+
+
+#Приветствие для новых участников
+@dp.chat_member_handler()
+async def on_chat_member_update(update: types.ChatMemberUpdated):
+    print("📥 Событие chat_member пришло!")
+    if update.chat.id != CULT_CHANNEL_ID:
+        return
+
+    new_status = update.new_chat_member.status
+    if new_status != "member":
+        return  # Только вступившие
+
+    user_id = update.new_chat_member.user.id
+    players = load_players()
+    player = players.get(str(user_id))
+
+    if not player or player.get("team") != "cult":
+        return
+
+    identity_id = player.get("identity_id")
+    if not identity_id:
+        return
+
+    try:
+        with open(IDENTITIES_FILE, encoding="utf-8") as f:
+            identities = json.load(f)
+    except Exception as e:
+        await bot.send_message(ADMIN_ID, f"⚠️ Не удалось загрузить cultist_identities.json: {e}")
+        return
+
+    identity = next((i for i in identities if i["id"] == identity_id), None)
+    if not identity:
+        return
+
+    mention = update.new_chat_member.user.get_mention(as_html=True)
+    await bot.send_message(
+        CULT_CHANNEL_ID,
+        f"🌒 Новое лицо под маской вступило в культ.\n"
+        f"{mention} теперь {identity['name']} {identity['mask_symbol']}\n"
+        f"<i>{identity['description']}</i>\n"
+        f"ℹ️ Инструкции отправлены ему в личные сообщения.",
+        parse_mode="HTML"
+    )
+
+#кнопка старт для игроков
+@dp.message_handler(commands=["start"])
+async def start_handler(message: types.Message, state: FSMContext):
+    args = message.get_args() or ""
+
+    # 🔒 Пусть fbi-роутер обрабатывает /start fbi_*
+    if args.lower().startswith("fbi_"):
+        return
+    # 👉 СНАЧАЛА: приём weapon через deeplink
+    if args.lower().startswith("weapon-"):
+        payload = args.split("-", 1)[-1]
+        return await process_weapon_submission(message, payload)
+
+
+    # Обычное поведение
+    kb = InlineKeyboardMarkup(row_width=2)
+    kb.add(
+        InlineKeyboardButton("🔮 Вступить в Культ", callback_data="join_cult"),
+        InlineKeyboardButton("🕵️ Присоединиться к ФБР", callback_data="join_fbi")
+    )
+    await message.answer("Выбери свою сторону:", reply_markup=kb)
+    
+async def process_weapon_submission(message: types.Message, weapon_payload: str):
+    # 1) Только личка
+    if message.chat.type != "private":
+        try:
+            # нормализуем, чтобы сразу дать удобную ссылку
+            wid_hint = normalize_weapon_id(weapon_payload or "XXXX")
+            deeplink = bot_identity.deeplink(f"weapon-{wid_hint or 'XXXX'}")
+            await message.reply(
+                f"⛔ Отправь ID оружия мне в личку.\n"
+                f"👉 <a href='{deeplink}'>Открыть диалог</a>",
+                parse_mode="HTML"
+            )
+        except Exception:
+            await message.reply("⛔ Отправь ID оружия мне в личку.")
+        return
+
+    user_id = message.from_user.id
+    username = message.from_user.username or f"id:{user_id}"
+
+    # 2) Нормализация
+    weapon_id = normalize_weapon_id(weapon_payload or "")
+    if len(weapon_id) < 2:
+        await message.reply("❌ Неверный/слишком короткий ID. Пример: <code>weapon:ABC123</code>", parse_mode="HTML")
+        return
+
+    # 3) Ивент
+    event = load_event()
+    if not event:
+        await message.reply("❌ Сейчас нет активного ритуала.")
+        return
+
+    # 4) Оружие из базы (индекс в памяти)
+    try:
+        ids_norm = weapon_index.ids_for(event.get("weapon"))
+    except Exception:
+        await message.reply("⚠️ Не удалось загрузить weapons.json.")
+        return
+
+    if ids_norm is None:
+        await message.reply("❌ Оружие задания не найдено в базе.")
+        return
+
+    if weapon_id not in ids_norm:
+        await message.reply(
+            "❌ Неверный ID — он не относится к текущему оружию.\n"
+            f"🔎 Сейчас в задании: <b>{event.get('weapon')}</b>.\n"
+            "Проверь QR/раскладку (например, <code>Т≠T</code>, <code>Х≠X</code>) и попробуй ещё раз.",
+            parse_mode="HTML"
+        )
+        return
+
+    # 5) Запрет повторов по отчётам (если уже сдавал по этой жертве)
+    reports = load_all_reports()
+    victim_key = str(event.get("victim_id"))
+    if victim_key in reports:
+        if any(r.get("user_id") == user_id for r in reports[victim_key].get("reports", [])):
+            await message.reply("⛔ Ты уже сдавал отчёт по этому ритуалу.")
+            return
+
+    # 6) Сохраняем weapon за пользователем в текущем ивенте
+    async with store.locked("event"):
+        current = load_event()
+        same_ritual = bool(current) and current.get("victim_id") == event.get("victim_id")
+        if same_ritual:
+            current.setdefault("assigned_weapons", [])
+            current["assigned_weapons"] = [w for w in current["assigned_weapons"] if w.get("user_id") != user_id]
+            current["assigned_weapons"].append({"user_id": user_id, "weapon_id": weapon_id})
+            save_event(current)
+
+    if not same_ritual:
+        await message.reply("⌛ Ритуал уже сменился. Проверь новое задание в канале культа.")
+        return
+
+    await message.reply(
+        f"🔐 Твой ID оружия (<code>{weapon_id}</code>) принят.\n"
+        f"📸 Теперь пришли фото ритуала **одним сообщением** — оно уйдёт на проверку.",
+        parse_mode="HTML"
+    )
+
+
+## ==== ОБРАБОТКА ОРУЖИЯ ====   
+@dp.message_handler(lambda m: m.text and re.match(r'^\s*weapon\s*:\s*', m.text, re.I))
+async def handle_weapon_qr(message: types.Message):
+    m = re.match(r'^\s*weapon\s*:\s*(.+)$', message.text, re.I | re.S)
+    weapon_id_raw = m.group(1) if m else ""
+    await process_weapon_submission(message, weapon_id_raw)
+
+# ==== ЗАПУСК ====
+
+def run():
+    """Запустить бота (polling или вебхук). Вызывается из main.py."""
+    print("Бот запущен.")
+    if webhook_mode.is_webhook():
+        # вебхук: свой aiohttp-сервер, на SIGTERM/SIGINT он дожидается
+        # текущих запросов и вызывает on_shutdown
+        executor.set_webhook(
+            dp,
+            webhook_mode.WEBHOOK_PATH,
+            web_app=webhook_mode.make_app(),
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            skip_updates=False,
+        ).run_app(host=webhook_mode.WEBAPP_HOST, port=webhook_mode.WEBAPP_PORT)
+    else:
+        executor.start_polling(
+            dp,
+            on_startup=on_startup,          # ← добавили
+            on_shutdown=on_shutdown,
+            skip_updates=False,
+            allowed_updates=ALLOWED_UPDATES
+        )
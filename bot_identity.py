@@ -0,0 +1,66 @@
+# bot_identity.py
+"""
+Кто мы в Telegram — один get_me() на процесс.
+
+Профиль бота запрашивается в on_startup и дальше берётся из памяти, так что
+ссылки «открыть ЛС» собираются синхронно, без сетевого вызова в хендлере.
+BOT_IDENTITY_REFRESH — раз во сколько секунд перезапрашивать профиль
+(0 — никогда; по умолчанию так и есть, username бота меняется редко).
+"""
+import asyncio
+import os
+
+_me = None
+_refresh_task = None
+
+
+async def refresh(bot):
+    global _me
+    _me = await bot.get_me()
+    return _me
+
+
+def me():
+    """Профиль бота (types.User). До start() — RuntimeError."""
+    if _me is None:
+        raise RuntimeError("Профиль бота ещё не загружен (bot_identity.start не вызван)")
+    return _me
+
+
+def deeplink(payload=None):
+    """https://t.me/<бот> или https://t.me/<бот>?start=<payload>."""
+    url = f"https://t.me/{me().username}"
+    if payload:
+        url += f"?start={payload}"
+    return url
+
+
+async def _refresh_loop(bot, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh(bot)
+        except Exception as e:
+            print(f"[identity] ⚠️ Не удалось обновить профиль бота: {e}")
+
+
+async def start(bot):
+    """Из on_startup: запросить профиль и, если задано, обновлять его в фоне."""
+    global _refresh_task
+    await refresh(bot)
+    print(f"[identity] Бот @{_me.username}")
+    # читаем здесь, а не при импорте: .env к тому моменту ещё не подгружен
+    interval = float(os.getenv("BOT_IDENTITY_REFRESH", "0"))
+    if interval > 0 and _refresh_task is None:
+        _refresh_task = asyncio.create_task(_refresh_loop(bot, interval))
+
+
+async def stop():
+    global _refresh_task
+    task, _refresh_task = _refresh_task, None
+    if task:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
@@ -0,0 +1,71 @@
+# case_repository.py
+"""
+Дела ФБР с индексами в памяти.
+
+Сами карточки — ресурс "cases" в store (fbi_cases.json или SQLite), а здесь
+поверх них два словаря: (victim_id, report_index) -> дело и case_id -> дело.
+Все хендлеры ФБР ищут дела через общий case_repo, так что поиск — O(1), а не
+перебор всех когда-либо созданных дел с приведением типов.
+
+Индексы перестраиваются сами, если список дел в store подменили целиком;
+новые дела добавляются через add(), изменения найденного дела — save().
+Без await — вызывать под store.locked("cases").
+"""
+from store import store
+
+
+def _key(victim_id, report_index):
+    return int(victim_id), int(report_index)
+
+
+class CaseRepository:
+    def __init__(self):
+        self._cases = None    # список из store, по которому построены индексы
+        self._by_key = {}
+        self._by_id = {}
+
+    def _index(self):
+        cases = store.get("cases")
+        if cases is not self._cases:
+            self._cases = cases
+            self._by_key, self._by_id = {}, {}
+            for case in cases:
+                self._remember(case)
+        return cases
+
+    def _remember(self, case):
+        try:
+            self._by_key[_key(case.get("victim_id"), case.get("report_index"))] = case
+        except (TypeError, ValueError):
+            print(f"[cases] ⚠️ Дело без victim_id/report_index: {case.get('case_id')}")
+        self._by_id[case.get("case_id")] = case
+
+    def all(self):
+        return self._index()
+
+    def get(self, victim_id, report_index):
+        """Дело по жертве и номеру отчёта или None."""
+        self._index()
+        return self._by_key.get(_key(victim_id, report_index))
+
+    def by_id(self, case_id):
+        self._index()
+        return self._by_id.get(case_id)
+
+    def add(self, new_cases):
+        """Дописать дела, которых ещё нет (по case_id); вернуть добавленные."""
+        cases = self._index()
+        added = [c for c in new_cases if c.get("case_id") not in self._by_id]
+        for case in added:
+            cases.append(case)
+            self._remember(case)
+        if added:
+            store.set("cases", cases)
+        return added
+
+    def save(self):
+        """Сохранить изменения в уже найденных делах."""
+        store.set("cases", self._index())
+
+
+case_repo = CaseRepository()
@@ -1,8 +1,7 @@
-import json
+import asyncio
 import hashlib
 import random
 import os
-import cv2
 from urllib.parse import urlparse, parse_qs
 from pathlib import Path
 from aiogram import types
@@ -10,11 +9,16 @@ from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ChatMemberUpdated
 from aiogram import Dispatcher
-from shared import load_players, load_all_reports, load_victims, load_cultists, load_rituals, load_texts, send_info
+from shared import load_players, load_all_reports, load_victims, load_cultists, load_rituals, load_texts, send_info, add_score
 from datetime import datetime, timedelta
 TZ_OFFSET = timedelta(hours=3)
-from photo_tools import ultra_obscured_version
+from photo_tools import ultra_obscured_version_async
 from aiogram.dispatcher.handler import SkipHandler  # импорт вверху файла
+from store import store
+from case_repository import case_repo
+import qr_tools
+import photo_cache
+import bot_identity
 
 
 REPORT_FILE = Path("ritual_reports.json")
@@ -41,20 +45,17 @@ def normalize_weapon_id(text):
     text = text.strip().upper()
     return "".join(mapping.get(ch, ch) for ch in text)
 
-def extract_weapon_from_qr(image_path: str):
+async def extract_weapon_from_qr(image):
     """
     Возвращает weapon_id из QR, если на фото есть:
       - https://t.me/<bot>?start=weapon-XXXX
       - tg://resolve?domain=<bot>&start=weapon-XXXX
       - просто текст 'weapon-XXXX' или 'weapon:XXXX'
-    Иначе None.
+    Иначе None. image — байты картинки (или путь к файлу); само распознавание
+    идёт в пуле qr_tools, не блокируя loop.
     """
     try:
-        img = cv2.imread(str(image_path))
-        if img is None:
-            return None
-        det = cv2.QRCodeDetector()
-        data, _, _ = det.detectAndDecode(img)
+        data = await qr_tools.decode_qr(image)
         if not data:
             return None
 
@@ -91,59 +92,215 @@ def generate_case_code(victim_id: int) -> str:
     letters = ''.join(alphabet[b % len(alphabet)] for b in hash_bytes[:4])
     return f"RIT-{letters}"
 
+# ==== КОДЫ ДЕЛ ====
+# Код дела считается один раз — при создании — и хранится в карточке
+# (case_code). Для старых карточек без кода он вычисляется один раз за процесс.
+# Таблица код -> victim_id собирается из карточек; если хеш нового кода уже занят
+# другой жертвой (пространство 32^4), код пересчитывается с солью. Уникальный код
+# служит ключом в callback data вместо victim_id.
+_case_codes = None   # код -> victim_id
+_victim_codes = {}   # victim_id -> код
+
+def _code_table():
+    global _case_codes
+    if _case_codes is None:
+        _case_codes = {}
+        for c in load_cases():
+            vid = int(c.get("victim_id"))
+            code = c.get("case_code") or _victim_codes.get(vid) or generate_case_code(vid)
+            if _case_codes.get(code, vid) != vid:
+                print(f"[FBI] ⚠️ Код {code} уже у жертвы {_case_codes[code]}, у жертвы {vid} — без индекса")
+                _victim_codes.setdefault(vid, code)
+                continue
+            _case_codes[code] = vid
+            _victim_codes[vid] = code
+    return _case_codes
+
+def case_code_for(victim_id: int) -> str:
+    """Код дела жертвы: из карточки, из памяти или новый (без коллизий)."""
+    victim_id = int(victim_id)
+    table = _code_table()
+    code = _victim_codes.get(victim_id)
+    if code:
+        return code
+    code, salt = generate_case_code(victim_id), 0
+    while code in table:
+        salt += 1
+        print(f"[FBI] Коллизия кода {code} для жертвы {victim_id}, пересчитываю")
+        code = generate_case_code(f"{victim_id}:{salt}")
+    table[code] = victim_id
+    _victim_codes[victim_id] = code
+    return code
+
+def victim_by_code(code: str):
+    return _code_table().get(code)
+
+def case_callback_key(victim_id: int, report_index: int) -> str:
+    """Ключ дела для callback data: «код:индекс», если код однозначен, иначе «victim_id:индекс»."""
+    code = case_code_for(victim_id)
+    if victim_by_code(code) == int(victim_id):
+        return f"{code}:{report_index}"
+    return f"{victim_id}:{report_index}"
+
+def parse_case_callback_key(key: str):
+    """(victim_id, report_index) из ключа; старые кнопки несут victim_id. None — если код неизвестен."""
+    head, report_index_str = key.rsplit(":", 1)
+    victim_id = victim_by_code(head) if head.startswith("RIT-") else int(head)
+    if victim_id is None:
+        return None
+    return victim_id, int(report_index_str)
+
 def load_cases():
-    if CASES_FILE.exists():
-        with open(CASES_FILE, encoding="utf-8") as f:
-            return json.load(f)
-    return []
+    return case_repo.all()
 
 def load_scores():
+    return store.get("scores")
+
+
+# ==== ИНДЕКС ОТКРЫТЫХ ДЕЛ ====
+# Карточки открытых дел для /дела и /расследовать собираются один раз на дело
+# (код, время, имя жертвы) и живут в памяти: create_fbi_cases_for_victim
+# добавляет новые, record_attempt убирает закрытые.
+_open_index = None  # case_id -> карточка для списка
+
+def _open_case_view(c, victims):
+    victim_id = int(c.get("victim_id"))
+    victim_name = c.get("victim_name") or victims.get(victim_id, {}).get("name")
+    place = c.get("place")
+    report_index = int(c.get("report_index", 0))
     try:
-        with open(SCORES_FILE, encoding="utf-8") as f:
-            return json.load(f)
+        short_time = (datetime.fromisoformat(c.get("created_at")) + TZ_OFFSET).strftime("%H:%M")
     except Exception:
-        return {}
-
-def save_scores(data):
-    with open(SCORES_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+        short_time = "??:??"
+    return {
+        # сохраняем старый формат, чтобы UI и FSM работали без переделок
+        "report_key": case_callback_key(victim_id, report_index),
+        "victim_id": victim_id,
+        "report_index": report_index,
+        "case_code": c.get("case_code") or case_code_for(victim_id),
+        "victim_name": victim_name,
+        "place": (place or "").strip().split()[-1] if place else "",
+        "ritual": c.get("ritual"),
+        "time": short_time
+    }
 
-def save_cases(cases):
-    with open(CASES_FILE, "w", encoding="utf-8") as f:
-        json.dump(cases, f, ensure_ascii=False, indent=2)
+def _open_cases_index():
+    global _open_index
+    if _open_index is None:
+        victims = load_victims()
+        _open_index = {
+            c.get("case_id"): _open_case_view(c, victims)
+            for c in load_cases() if c.get("status") == "open"
+        }
+    return _open_index
 
-def get_open_cases():
-    cases = load_cases()
+def _index_open_cases(new_cases):
+    if _open_index is None:
+        return  # индекс ещё не строился — построится из дел целиком
     victims = load_victims()
+    for c in new_cases:
+        if c.get("status") == "open":
+            _open_index[c.get("case_id")] = _open_case_view(c, victims)
 
-    open_cases = []
-    for c in cases:
-        if c.get("status") != "open":
-            continue
-        victim_id = int(c.get("victim_id"))
-        victim_name = c.get("victim_name") or victims.get(victim_id, {}).get("name")
-        place = c.get("place")
-        ritual = c.get("ritual")
-        report_index = int(c.get("report_index", 0))
-        created_at = c.get("created_at")
-        try:
-            short_time = (datetime.fromisoformat(created_at) + TZ_OFFSET).strftime("%H:%M")
-        except Exception:
-            short_time = "??:??"
+def _unindex_case(case_id):
+    if _open_index is not None:
+        _open_index.pop(case_id, None)
 
-        open_cases.append({
-            # сохраняем старый формат, чтобы UI и FSM работали без переделок
-            "report_key": f"{victim_id}:{report_index}",
-            "victim_id": victim_id,
-            "report_index": report_index,
-            "case_code": generate_case_code(victim_id),
-            "victim_name": victim_name,
-            "place": (place or "").strip().split()[-1] if place else "",
-            "ritual": ritual,
-            "time": short_time
-        })
-    return open_cases
+def get_open_cases():
+    return list(_open_cases_index().values())
     
+def record_attempt(agent_id: int, victim_id: int, report_index: int, data: dict) -> dict:
+    """
+    Проверяет ответы агента по делу, записывает попытку, начисляет очки и при
+    полном совпадении закрывает дело. Без await — вызывать под store.locked("scores", "cases").
+    Возвращает {"status": ...}; при status == "ok" — ещё case, award, result, closed_case.
+    """
+    # 1) Найдём дело
+    case = case_repo.get(victim_id, report_index)
+    if not case:
+        return {"status": "missing"}
+
+    if case.get("status") == "closed":
+        return {"status": "closed", "case": case}
+
+    # 2) Один агент — одна попытка
+    attempts = case.get("attempts", [])
+    if any(int(a.get("agent_id", 0)) == agent_id for a in attempts):
+        return {"status": "repeat", "case": case}
+
+    # 3) Истина из принятых отчётов
+    all_reports = load_all_reports()
+    block = all_reports.get(str(victim_id))
+    if not block:
+        return {"status": "no_block", "case": case}
+    reports = block.get("reports", [])
+    if report_index >= len(reports):
+        return {"status": "no_report", "case": case}
+    rep = reports[report_index]
+    true_weapon = (rep.get("weapon_id") or "").strip().upper()
+
+    # маска из identity
+    identity_id = rep.get("identity_id")
+    cultists = load_cultists()
+    identity = next((c for c in cultists if str(c.get("id")) == str(identity_id)), None)
+    true_mask = identity.get("mask_symbol") if identity else None
+
+    true_ritual = block.get("ritual")
+    true_victim_id = victim_id  # по case
+
+    # 4) Ответы агента
+    selected_victim_id = int(data.get("selected_victim_id", -1))
+    agent_weapon = (data.get("weapon_id") or "").strip().upper()
+    agent_mask = data.get("chosen_mask_symbol")
+    agent_ritual = data.get("ritual_guess")
+
+    # 5) Проверка (все 4 должны быть True)
+    victim_correct = (selected_victim_id == true_victim_id)
+    weapon_correct = (agent_weapon == true_weapon)
+    mask_checked = true_mask is not None
+    mask_correct = (agent_mask == true_mask) if mask_checked else False
+    ritual_correct = (agent_ritual == true_ritual)
+
+    all_ok = victim_correct and weapon_correct and mask_correct and ritual_correct
+
+    # 6) Записываем попытку
+    result = {
+        "victim_correct": victim_correct,
+        "weapon_correct": weapon_correct,
+        "mask_correct": mask_correct if mask_checked else None,
+        "ritual_correct": ritual_correct
+    }
+    attempt = {
+        "agent_id": agent_id,
+        "timestamp": (datetime.utcnow() + TZ_OFFSET).isoformat(),
+        "answers": {
+            "victim_id": selected_victim_id,
+            "weapon_id": agent_weapon,
+            "mask_symbol": agent_mask,
+            "ritual_guess": agent_ritual
+        },
+        "result": result,
+        "closed_case": all_ok
+    }
+    attempts.append(attempt)
+    case["attempts"] = attempts
+    # === вычисляем очки по новой схеме ===
+    base_points = int(victim_correct) + int(weapon_correct) + (int(mask_correct) if mask_checked else 0) + int(ritual_correct)
+    bonus = 1 if (mask_checked and victim_correct and weapon_correct and mask_correct and ritual_correct) else 0
+    award = base_points + bonus
+
+    add_score(agent_id, award)
+
+    # 7) Если всё верно — закрываем
+    if all_ok:
+        case["status"] = "closed"
+        case["solved_by"] = agent_id
+        case["solved_at"] = (datetime.utcnow() + TZ_OFFSET).isoformat()
+        _unindex_case(case.get("case_id"))
+
+    case_repo.save()
+    return {"status": "ok", "case": case, "award": award, "result": result, "closed_case": all_ok}
+
 def register_fbi_handlers(dp: Dispatcher):
 
     @dp.chat_member_handler()
@@ -169,13 +326,12 @@ def register_fbi_handlers(dp: Dispatcher):
         if getattr(new.user, "is_bot", False):
             return
 
-        me = await event.bot.get_me()
         texts = load_texts()
 
         kb = InlineKeyboardMarkup().add(
             InlineKeyboardButton(
                 "📘 Инструкция ФБР (в личку)",
-                url=f"https://t.me/{me.username}?start=info_fbi"
+                url=bot_identity.deeplink("info_fbi")
             )
         )
 
@@ -196,11 +352,10 @@ def register_fbi_handlers(dp: Dispatcher):
     @dp.message_handler(commands=["дела"])
     async def show_open_cases(message: types.Message, state: FSMContext):
         if message.chat.type != "private":
-            me = await message.bot.get_me()
             kb = InlineKeyboardMarkup().add(
                 InlineKeyboardButton(
                     text="Открыть личку с ботом",
-                    url=f"https://t.me/{me.username}?start=fbi_cases"
+                    url=bot_identity.deeplink("fbi_cases")
                 )
             )
             await message.reply("⛔ Команда доступна в личке боту.", reply_markup=kb)
@@ -242,11 +397,10 @@ def register_fbi_handlers(dp: Dispatcher):
     @dp.message_handler(commands=["расследовать"], state="*")
     async def start_fbi_report(message: types.Message, state: FSMContext):
         if message.chat.type != "private":
-            me = await message.bot.get_me()
             kb = InlineKeyboardMarkup().add(
                 InlineKeyboardButton(
                     text="Открыть личку с ботом",
-                    url=f"https://t.me/{me.username}?start=fbi_investigate"
+                    url=bot_identity.deeplink("fbi_investigate")
                 )
             )
             await message.reply("⛔ Расследование ведётся в личке боту.", reply_markup=kb)
@@ -283,19 +437,17 @@ def register_fbi_handlers(dp: Dispatcher):
             await callback.answer("⛔ Только в личке.", show_alert=True)
             return
 
-        report_key = callback.data.split(":", 1)[1]
-        victim_id_str, report_index_str = report_key.split(":")
-        victim_id = int(victim_id_str)
-        report_index = int(report_index_str)
+        parsed = parse_case_callback_key(callback.data.split(":", 1)[1])
+        if parsed is None:
+            await callback.answer("⚠️ Дело не найдено или удалено.", show_alert=True)
+            return
+        victim_id, report_index = parsed
         await state.update_data(victim_id=victim_id, report_index=report_index)
         # внутри select_case() сразу после:
         # await state.update_data(victim_id=victim_id, report_index=report_index)
 
         # найдём нужное дело
-        cases = load_cases()
-        case = next((c for c in cases
-                     if int(c.get("victim_id", -1)) == victim_id
-                     and int(c.get("report_index", -1)) == report_index), None)
+        case = case_repo.get(victim_id, report_index)
 
         # если есть file_id — пошлём фото; если нет — попробуем с диска
         if case:
@@ -411,19 +563,9 @@ def register_fbi_handlers(dp: Dispatcher):
             await message.reply("⛔ Отправь фото с QR в личку боту.")
             return
 
-        # Скачиваем фото во временный файл
-        photo = message.photo[-1]
-        os.makedirs("tmp", exist_ok=True)
-        tmp_path = Path("tmp") / f"fbi_qr_{message.from_user.id}_{photo.file_unique_id}.jpg"
-        await photo.download(destination_file=tmp_path)
-
-        try:
-            wid = extract_weapon_from_qr(str(tmp_path))
-        finally:
-            try:
-                tmp_path.unlink(missing_ok=True)
-            except Exception:
-                pass
+        # Скачиваем фото в память и распознаём прямо из буфера
+        image_bytes = await photo_cache.get_photo_bytes(message.photo[-1])
+        wid = await extract_weapon_from_qr(image_bytes)
 
         if not wid:
             await message.reply(
@@ -535,7 +677,7 @@ def register_fbi_handlers(dp: Dispatcher):
         await state.update_data(ritual_guess=ritual)
 
         data = await state.get_data()
-        case_code = generate_case_code(data["victim_id"])
+        case_code = case_code_for(data["victim_id"])
 
         summary = (
             "📝 <b>Контрольный лист</b>\n\n"
@@ -564,17 +706,19 @@ def register_fbi_handlers(dp: Dispatcher):
         victim_id = int(data.get("victim_id"))
         report_index = int(data.get("report_index"))
 
-        # 1) Найдём дело
-        cases = load_cases()
-        case = next((c for c in cases
-                     if int(c.get("victim_id", -1)) == victim_id
-                     and int(c.get("report_index", -1)) == report_index), None)
-        if not case:
+        # 1–6) Проверка и запись попытки — под замками дел и очков,
+        # сообщения агенту и в канал отправляем уже после
+        async with store.locked("scores", "cases"):
+            outcome = record_attempt(agent_id, victim_id, report_index, data)
+
+        status = outcome["status"]
+        if status == "missing":
             await callback.message.edit_text("⚠️ Дело не найдено или удалено.")
             await state.finish()
             return
 
-        if case.get("status") == "closed":
+        if status == "closed":
+            case = outcome["case"]
             closer = case.get("solved_by")
             when = case.get("solved_at", "")[:16].replace("T", " ")
             who = f"агент tg://user?id={closer}" if closer else "другой агент"
@@ -585,88 +729,28 @@ def register_fbi_handlers(dp: Dispatcher):
             await state.finish()
             return
 
-        # 2) Один агент — одна попытка
-        attempts = case.get("attempts", [])
-        if any(int(a.get("agent_id", 0)) == agent_id for a in attempts):
+        if status == "repeat":
             await callback.message.edit_text("⛔ У вас уже была попытка по этому делу.")
             await state.finish()
             return
 
-        # 3) Истина из принятых отчётов
-        all_reports = load_all_reports()
-        block = all_reports.get(str(victim_id))
-        if not block:
+        if status == "no_block":
             await callback.message.edit_text("⚠️ Исходные данные по делу не найдены.")
             await state.finish()
             return
-        reports = block.get("reports", [])
-        if report_index >= len(reports):
+
+        if status == "no_report":
             await callback.message.edit_text("⚠️ Репорт по делу не найден.")
             await state.finish()
             return
-        rep = reports[report_index]
-        true_weapon = (rep.get("weapon_id") or "").strip().upper()
 
-        # маска из identity
-        identity_id = rep.get("identity_id")
-        cultists = load_cultists()
-        identity = next((c for c in cultists if str(c.get("id")) == str(identity_id)), None)
-        true_mask = identity.get("mask_symbol") if identity else None
-
-        true_ritual = block.get("ritual")
-        true_victim_id = victim_id  # по case
-
-        # 4) Ответы агента
-        selected_victim_id = int(data.get("selected_victim_id", -1))
-        agent_weapon = (data.get("weapon_id") or "").strip().upper()
-        agent_mask = data.get("chosen_mask_symbol")
-        agent_ritual = data.get("ritual_guess")
-
-        # 5) Проверка (все 4 должны быть True)
-        victim_correct = (selected_victim_id == true_victim_id)
-        weapon_correct = (agent_weapon == true_weapon)
-        mask_checked = true_mask is not None
-        mask_correct = (agent_mask == true_mask) if mask_checked else False
-        ritual_correct = (agent_ritual == true_ritual)
-
-        all_ok = victim_correct and weapon_correct and mask_correct and ritual_correct
-
-        # 6) Записываем попытку
-        attempt = {
-            "agent_id": agent_id,
-            "timestamp": (datetime.utcnow() + TZ_OFFSET).isoformat(),
-            "answers": {
-                "victim_id": selected_victim_id,
-                "weapon_id": agent_weapon,
-                "mask_symbol": agent_mask,
-                "ritual_guess": agent_ritual
-            },
-            "result": {
-                "victim_correct": victim_correct,
-                "weapon_correct": weapon_correct,
-                "mask_correct": mask_correct if mask_checked else None,
-                "ritual_correct": ritual_correct
-            },
-            "closed_case": all_ok
-        }
-        attempts.append(attempt)
-        case["attempts"] = attempts
-        # === вычисляем очки по новой схеме ===
-        base_points = int(victim_correct) + int(weapon_correct) + (int(mask_correct) if mask_checked else 0) + int(ritual_correct)
-        bonus = 1 if (mask_checked and victim_correct and weapon_correct and mask_correct and ritual_correct) else 0
-        award = base_points + bonus
-
-        scores = load_scores()
-        scores[str(agent_id)] = scores.get(str(agent_id), 0) + award
-        save_scores(scores)
-
-        # 7) Если всё верно — закрываем, начисляем очки и публикуем в канал ФБР
-        if all_ok:
-            case["status"] = "closed"
-            case["solved_by"] = agent_id
-            case["solved_at"] = (datetime.utcnow() + TZ_OFFSET).isoformat()
-
-            # Очки
+        case = outcome["case"]
+        award = outcome["award"]
+        r = outcome["result"]
+        mask_checked = r["mask_correct"] is not None
+
+        # 7) Если всё верно — дело уже закрыто, публикуем в канал ФБР
+        if outcome["closed_case"]:
             await callback.message.edit_text(
                 "🟢 <b>Дело закрыто.</b>\n"
                 f"Начислено: +{award} очков (включая бонус за все четыре).\n"
@@ -693,17 +777,16 @@ def register_fbi_handlers(dp: Dispatcher):
                 "🔴 <b>Проверка не пройдена.</b>",
                 "Баллы за попытку: +" + str(award),
                 "Для закрытия требуется верный ответ по всем пунктам:",
-                f"• Жертва: {'✅' if victim_correct else '❌'}",
-                f"• Оружие: {'✅' if weapon_correct else '❌'}",
-                f"• Маска: {'✅' if mask_correct else '❌'}" if mask_checked else "• Маска: — (не проверяется в этом деле)",
-                f"• Ритуал: {'✅' if ritual_correct else '❌'}",
+                f"• Жертва: {'✅' if r['victim_correct'] else '❌'}",
+                f"• Оружие: {'✅' if r['weapon_correct'] else '❌'}",
+                f"• Маска: {'✅' if r['mask_correct'] else '❌'}" if mask_checked else "• Маска: — (не проверяется в этом деле)",
+                f"• Ритуал: {'✅' if r['ritual_correct'] else '❌'}",
                 "",
                 "Рекомендации: перечитайте досье, улики и внимательно проверьте транслитерацию оружия (A↔А, X↔Х)."
             ]
             await callback.message.edit_text("\n".join(lines), parse_mode="HTML")
 
-        # 8) Сохранить дела и завершить FSM
-        save_cases(cases)
+        # 8) Завершить FSM
         await state.finish()
         
     @dp.message_handler(lambda m: (m.text or "").lower().startswith(("/start fbi_", "/start info_")), state="*")
@@ -731,13 +814,101 @@ def register_fbi_handlers(dp: Dispatcher):
         # если сюда попали — пропускаем к следующему хендлеру
         raise SkipHandler()
 
+# ==== ПРЕДРЕНДЕР ИСКАЖЁННЫХ ФОТО ====
+# Фото отчёта есть с момента, как модератор его принял, — искажённую версию
+# начинаем готовить сразу (в пуле процессов), а создание дела потом только берёт
+# готовый файл. Результат лежит в PRERENDER_DIR под ключом фото, так что
+# повторные попытки и рестарты переиспользуют его; при создании дела файл
+# переносится на место (os.replace), при отклонении отчёта — удаляется.
+PRERENDER_DIR = Path("fbi_cases") / "prerender"
+_prerender_tasks = {}  # ключ фото -> asyncio.Task с путём к готовому файлу
+_prerender_running = set()  # ссылки на идущие задачи, чтобы их не собрал GC
+
+def _log_prerender_failure(task):
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        print(f"[FBI] ⚠️ Предрендер искажённого фото упал: {exc!r}")
+
+def _prerender_key(src: Path) -> str:
+    st = src.stat()
+    return f"{src.stem}-{st.st_size}-{st.st_mtime_ns}"
+
+async def _render_obscured(src: Path, out: Path):
+    if out.exists():
+        return out
+    produced_path = await ultra_obscured_version_async(src)  # функция вернёт путь к _distorted.jpg
+    if not produced_path or not os.path.exists(produced_path):
+        return None
+
+    out.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(produced_path, out)  # атомарное перемещение
+    except Exception:
+        # fallback: копия+удаление
+        import shutil
+        shutil.copyfile(produced_path, out)
+        try:
+            os.remove(produced_path)
+        except Exception:
+            pass
+    return out
+
+def prerender_case_photo(src) -> asyncio.Task:
+    """Начать (или вернуть уже идущую) подготовку искажённой версии фото отчёта."""
+    src = Path(src)
+    key = _prerender_key(src)
+    task = _prerender_tasks.get(key)
+    failed = task is not None and task.done() and (task.cancelled() or task.exception() or not task.result())
+    if task is None or failed:
+        task = asyncio.ensure_future(_render_obscured(src, PRERENDER_DIR / f"{key}.jpg"))
+        _prerender_tasks[key] = task
+        _prerender_running.add(task)
+        task.add_done_callback(_prerender_running.discard)
+        task.add_done_callback(_log_prerender_failure)
+    return task
+
+def _remove_prerendered(task):
+    if task.cancelled() or task.exception() is not None or not task.result():
+        return
+    Path(task.result()).unlink(missing_ok=True)
+
+def discard_case_photo_prerender(src):
+    """Отчёт отклонён: убрать его предрендер (готовый — сразу, идущий — по завершении)."""
+    src = Path(src)
+    if not src.exists():
+        return
+    key = _prerender_key(src)
+    task = _prerender_tasks.pop(key, None)
+    if task is not None and not task.done():
+        task.add_done_callback(_remove_prerendered)
+    (PRERENDER_DIR / f"{key}.jpg").unlink(missing_ok=True)
+
+async def _obscure_case_photo(src: Path, obscured: Path):
+    """Искажённая версия фото отчёта под именем obscured (из предрендера). None — не вышло."""
+    if obscured.exists():
+        return obscured  # повтор после неудачной публикации — файл уже на месте
+    key = _prerender_key(src)
+    prepared = await prerender_case_photo(src)
+    if not prepared:
+        return None
+    _prerender_tasks.pop(key, None)
+
+    # хотим хранить всё в папке fbi_cases с предсказуемым именем
+    os.replace(prepared, obscured)
+    return obscured
+
 async def create_fbi_cases_for_victim(victim_id: int, bot, fbi_channel_id: int) -> int:
     """
     На каждый принятый отчёт по жертве создаёт отдельное дело ФБР:
-    - делает искажённую копию фото отчёта
-    - постит дело в канал ФБР (фото + описание)
-    - сохраняет карточку дела в data/fbi_cases.json
-    Возвращает количество созданных дел.
+    - делает искажённую копию фото отчёта (все отчёты параллельно, в пуле процессов)
+    - постит дело в канал ФБР (фото + описание), не больше FBI_UPLOAD_CONCURRENCY загрузок сразу
+    - карточку дела записывает на диск сразу после публикации, так что повтор
+      после падения не запостит то же дело в канал второй раз
+    Возвращает количество созданных дел. Если часть дел не удалось собрать или
+    опубликовать, бросает RuntimeError — повторный вызов доделает только
+    недостающие (отчёты, по которым дело уже есть, пропускаются).
     """
     all_reports = load_all_reports()
     block = all_reports.get(str(victim_id))
@@ -748,50 +919,34 @@ async def create_fbi_cases_for_victim(victim_id: int, bot, fbi_channel_id: int)
     if not accepted:
         return 0
 
-    cases = load_cases()
-    existing = {c.get("case_id") for c in cases}
 
-    created = 0
     out_dir = Path("fbi_cases")
     out_dir.mkdir(parents=True, exist_ok=True)
+    # из окружения при вызове: fbi импортируется раньше, чем грузится .env
+    upload_slots = asyncio.Semaphore(int(os.getenv("FBI_UPLOAD_CONCURRENCY", "3")))
+    failed = []
 
-    # Пробежимся по всем принятым отчётам по этой жертве: R1, R2, R3...
-    for idx, rep in enumerate(accepted, start=1):
+    async def build_case(idx, rep):
         case_id = f"{victim_id}-R{idx}"
-        if case_id in existing:
-            continue
-
         user_id = rep.get("user_id")
         # фото отчёта сохраняется у тебя как reports/ritual_{victim_id}_{user_id}.jpg
         src = Path("reports") / f"ritual_{victim_id}_{user_id}.jpg"
         if not src.exists():
             # бывают случаи, когда фото публиковалось по file_id — тогда оригинала на диске нет
             # в такой ситуации можно скипнуть или попытаться re-get через API — оставим скип
-            continue
+            return None
 
+        # хотим хранить всё в папке fbi_cases с предсказуемым именем
         try:
-            produced_path = ultra_obscured_version(str(src))  # функция вернёт путь к _distorted.jpg
-            if not produced_path or not os.path.exists(produced_path):
-                print(f"[FBI] Обфускация не удалась для {case_id}: файл не создан")
-                continue
-
-            # хотим хранить всё в папке fbi_cases с предсказуемым именем
-            obscured = out_dir / f"case_{case_id}_obscured.jpg"
-            # если функция сохранила в другом месте — перенесём/переименуем
-            if os.path.abspath(produced_path) != os.path.abspath(obscured):
-                try:
-                    os.replace(produced_path, obscured)  # атомарное перемещение
-                except Exception:
-                    # fallback: копия+удаление
-                    import shutil
-                    shutil.copyfile(produced_path, obscured)
-                    try:
-                        os.remove(produced_path)
-                    except Exception:
-                        pass
+            obscured = await _obscure_case_photo(src, out_dir / f"case_{case_id}_obscured.jpg")
         except Exception as e:
             print(f"[FBI] Обфускация не удалась для {case_id}: {e}")
-            continue
+            failed.append(case_id)
+            return None
+        if not obscured:
+            print(f"[FBI] Обфускация не удалась для {case_id}: файл не создан")
+            failed.append(case_id)
+            return None
 
         caption = (
             f"🗂 <b>Новое дело</b> — <b>#{case_id}</b>\n"
@@ -800,15 +955,18 @@ async def create_fbi_cases_for_victim(victim_id: int, bot, fbi_channel_id: int)
         )
 
         try:
-            with open(obscured, "rb") as ph:
-                posted = await bot.send_photo(fbi_channel_id, photo=ph, caption=caption, parse_mode="HTML")
+            async with upload_slots:
+                with open(obscured, "rb") as ph:
+                    posted = await bot.send_photo(fbi_channel_id, photo=ph, caption=caption, parse_mode="HTML")
             obscured_file_id = posted.photo[-1].file_id if posted.photo else None
         except Exception as e:
             print(f"[FBI] Не удалось опубликовать дело {case_id} в канал ФБР: {e}")
-            continue
+            failed.append(case_id)
+            return None
 
-        cases.append({
+        case = {
             "case_id": case_id,
+            "case_code": case_code_for(victim_id),
             "victim_id": victim_id,
             "victim_name": block.get("victim_name"),
             "ritual": block.get("ritual"),
@@ -818,12 +976,26 @@ async def create_fbi_cases_for_victim(victim_id: int, bot, fbi_channel_id: int)
             "report_user_id": user_id,
             "report_index": idx - 1,   # индекс репорта в массиве reports
             "status": "open"           # на будущее (можно закрывать)
-        })
-        existing.add(case_id)
-        created += 1
-
-    if created:
-        save_cases(cases)
+        }
+        # пост уже в канале — дело сохраняем сразу, не дожидаясь остальных
+        async with store.locked("cases"):
+            added = case_repo.add([case])
+            _index_open_cases(added)
+        if not await store.sync("cases"):
+            print(f"[FBI] ⚠️ Дело {case_id} опубликовано, но пока не записано на диск")
+        return added[0] if added else None
+
+    # Все принятые отчёты по этой жертве (R1, R2, R3...) — одновременно;
+    # отчёты, по которым дело уже есть (прошлая попытка), пропускаем
+    built = await asyncio.gather(*(
+        build_case(idx, rep)
+        for idx, rep in enumerate(accepted, start=1)
+        if case_repo.get(victim_id, idx - 1) is None
+    ))
+    created = sum(1 for c in built if c)
+
+    if failed:
+        raise RuntimeError(f"дела не созданы: {', '.join(sorted(failed))}")
 
     texts = load_texts()
     faq_fbi = texts.get("faq_fbi_card")
@@ -0,0 +1,64 @@
+# file_id_cache.py
+"""
+Кэш Telegram file_id для неизменных картинок с диска (фото жертв).
+
+Первая отправка загружает файл и запоминает file_id вместе с sha256 содержимого;
+дальше фото уходит по file_id без загрузки. Если файл на диске поменялся
+(другой хэш) или Telegram отверг старый file_id — загружаем заново.
+Кэш — ресурс "file_ids" в store (photo_file_ids.json).
+"""
+import hashlib
+import os
+
+from aiogram.utils.exceptions import BadRequest
+
+from store import store
+import metrics
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _fingerprint(path, entry):
+    """sha256 файла; пока не менялись mtime и размер — берём из кэша, не читая файл."""
+    st = os.stat(path)
+    if entry and entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+        return entry.get("sha256"), st
+    return _sha256(path), st
+
+
+async def send_photo_cached(bot, chat_id, path, **kwargs):
+    """bot.send_photo для файла с диска, по возможности — по закэшированному file_id."""
+    key = str(path)
+    cache = store.get("file_ids")
+    entry = cache.get(key)
+    digest, st = _fingerprint(key, entry)
+
+    if entry and entry.get("sha256") == digest and entry.get("file_id"):
+        try:
+            sent = await bot.send_photo(chat_id, photo=entry["file_id"], **kwargs)
+            metrics.inc("file_ids.hits")
+            return sent
+        except BadRequest as e:
+            print(f"[file_ids] file_id для {key} устарел ({e}), загружаю заново")
+            metrics.inc("file_ids.stale")
+
+    with open(key, "rb") as f:
+        sent = await bot.send_photo(chat_id, photo=f, **kwargs)
+    metrics.inc("file_ids.uploads")
+
+    if sent.photo:
+        cache = store.get("file_ids")
+        cache[key] = {
+            "sha256": digest,
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "file_id": sent.photo[-1].file_id,
+        }
+        store.set("file_ids", cache)
+    return sent
@@ -0,0 +1,178 @@
+# fsm_storage.py
+"""
+Хранилище состояний FSM (сценарий расследования ФБР), переживающее рестарт.
+
+FSM_STORAGE выбирает хранилище для Dispatcher:
+  - memory (по умолчанию) — MemoryStorage aiogram, как раньше;
+  - sqlite — SqliteStorage ниже, файл FSM_DB (по умолчанию fsm.db).
+
+SqliteStorage пишет каждое изменение строкой в таблицу fsm (chat, user) и
+держит в памяти не больше FSM_CACHE_SIZE последних записей (LRU), остальное
+подтягивается из базы по требованию. Состояние, которое не трогали дольше
+FSM_TTL секунд (по умолчанию сутки), считается брошенным: при чтении оно
+пустое, а из базы такие строки периодически вычищаются.
+API для хендлеров прежний — обычный FSMContext.
+"""
+import copy
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
+
+FSM_TTL = float(os.getenv("FSM_TTL", str(24 * 3600)))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "1000"))
+PURGE_EVERY = 500  # записей между чистками устаревших строк
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    chat    TEXT NOT NULL,
+    user    TEXT NOT NULL,
+    state   TEXT,
+    data    TEXT NOT NULL,
+    bucket  TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (chat, user)
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm(updated);
+"""
+
+
+def _empty():
+    return {"state": None, "data": {}, "bucket": {}}
+
+
+class SqliteStorage(BaseStorage):
+    def __init__(self, db_path="fsm.db", ttl=FSM_TTL, cache_size=FSM_CACHE_SIZE):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.conn = sqlite3.connect(str(db_path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._cache = OrderedDict()   # (chat, user) -> (запись, время изменения)
+        self._writes = 0
+        self._purge()
+
+    # ==== записи ====
+
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return str(chat), str(user)
+
+    def _expired(self, updated):
+        return self.ttl > 0 and time.time() - updated > self.ttl
+
+    def _load(self, key):
+        cached = self._cache.get(key)
+        if cached is None:
+            row = self.conn.execute(
+                "SELECT state, data, bucket, updated FROM fsm WHERE chat = ? AND user = ?", key
+            ).fetchone()
+            if row is None:
+                return _empty()
+            state, data, bucket, updated = row
+            cached = ({"state": state, "data": json.loads(data), "bucket": json.loads(bucket)}, updated)
+        record, updated = cached
+        if self._expired(updated):
+            self._drop(key)
+            return _empty()
+        self._remember(key, record, updated)
+        return record
+
+    def _remember(self, key, record, updated):
+        self._cache[key] = (record, updated)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _drop(self, key):
+        self._cache.pop(key, None)
+        with self.conn:
+            self.conn.execute("DELETE FROM fsm WHERE chat = ? AND user = ?", key)
+
+    def _save(self, key, record):
+        if record == _empty():
+            self._drop(key)
+            return
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fsm (chat, user, state, data, bucket, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, record["state"],
+                 json.dumps(record["data"], ensure_ascii=False),
+                 json.dumps(record["bucket"], ensure_ascii=False), now),
+            )
+        self._remember(key, record, now)
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self._purge()
+
+    def _purge(self):
+        if self.ttl <= 0:
+            return
+        with self.conn:
+            cur = self.conn.execute("DELETE FROM fsm WHERE updated < ?", (time.time() - self.ttl,))
+        if cur.rowcount:
+            print(f"[fsm] Удалено брошенных состояний: {cur.rowcount}")
+
+    def _change(self, chat, user, **fields):
+        key = self._key(chat, user)
+        record = copy.deepcopy(self._load(key))
+        record.update(fields)
+        self._save(key, record)
+
+    # ==== BaseStorage ====
+
+    async def close(self):
+        self._cache.clear()
+        self.conn.close()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        state = self._load(self._key(chat, user))["state"]
+        return state if state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        record = self._load(self._key(chat, user))
+        return copy.deepcopy(record["data"]) if record["data"] else (default or {})
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        self._change(chat, user, state=self.resolve_state(state))
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        self._change(chat, user, data=copy.deepcopy(data or {}))
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key = self._key(chat, user)
+        merged = copy.deepcopy(self._load(key)["data"])
+        merged.update(data or {}, **kwargs)
+        self._change(chat, user, data=merged)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        record = self._load(self._key(chat, user))
+        return copy.deepcopy(record["bucket"]) if record["bucket"] else (default or {})
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        self._change(chat, user, bucket=copy.deepcopy(bucket or {}))
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        key = self._key(chat, user)
+        merged = copy.deepcopy(self._load(key)["bucket"])
+        merged.update(bucket or {}, **kwargs)
+        self._change(chat, user, bucket=merged)
+
+
+def make_storage():
+    kind = os.getenv("FSM_STORAGE", "memory").strip().lower()
+    if kind == "sqlite":
+        return SqliteStorage(os.getenv("FSM_DB", "fsm.db"))
+    return MemoryStorage()
@@ -0,0 +1,144 @@
+# jobs.py
+"""
+Фоновая очередь задач с журналом на диске.
+
+Задачи живут в памяти и дублируются в JOURNAL_FILE (атомарная запись), поэтому
+переживают перезапуск бота. Один воркер разбирает очередь по времени готовности;
+упавшая задача повторяется с экспоненциальной задержкой.
+
+Задача идентифицируется парой (вид, ключ): повторная постановка той же задачи,
+пока она ещё в очереди, ничего не добавляет. Обработчики должны быть
+идемпотентны — задача может выполниться повторно после рестарта.
+
+Задача уходит из журнала только после того, как всё, что она поменяла в store,
+записано на диск (store.sync) — иначе падение в окне отложенного сброса
+потеряло бы и результат, и саму задачу.
+"""
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+
+from store import store, write_json_atomic
+import metrics
+
+JOURNAL_FILE = Path("jobs_journal.json")
+BACKOFF_BASE = 5.0    # сек, задержка после первой неудачи
+BACKOFF_MAX = 300.0   # сек, потолок задержки
+
+
+class JobQueue:
+    def __init__(self, journal=JOURNAL_FILE):
+        self.journal = Path(journal)
+        self._jobs = {}       # id -> задача
+        self._handlers = {}   # вид -> async def handler(payload)
+        self._wakeup = None
+        self._worker = None
+
+    def register(self, kind, handler):
+        self._handlers[kind] = handler
+
+    def _load(self):
+        if not self.journal.exists():
+            return
+        try:
+            with open(self.journal, encoding="utf-8") as f:
+                jobs = json.load(f)
+        except Exception as e:
+            print(f"[jobs] ⚠️ Не удалось прочитать журнал {self.journal}: {e}")
+            return
+        for job in jobs:
+            self._jobs[job["id"]] = job
+        if jobs:
+            print(f"[jobs] Восстановлено задач из журнала: {len(jobs)}")
+
+    def _persist(self):
+        write_json_atomic(self.journal, list(self._jobs.values()))
+        metrics.set_gauge("jobs.queued", len(self._jobs))
+
+    def enqueue(self, kind, key, payload):
+        """Поставить задачу. Возвращает её id (или id уже стоящей такой же)."""
+        job_id = f"{kind}:{key}"
+        if job_id in self._jobs:
+            return job_id
+        self._jobs[job_id] = {
+            "id": job_id,
+            "kind": kind,
+            "payload": payload,
+            "attempts": 0,
+            "next_at": time.time(),
+        }
+        self._persist()
+        if self._wakeup:
+            self._wakeup.set()
+        return job_id
+
+    async def _run_job(self, job):
+        handler = self._handlers.get(job["kind"])
+        if handler is None:
+            print(f"[jobs] ⚠️ Нет обработчика для {job['kind']}, задача {job['id']} отброшена")
+            self._jobs.pop(job["id"], None)
+            self._persist()
+            return
+
+        start = time.perf_counter()
+        try:
+            await handler(job["payload"])
+            if not await store.sync():
+                raise RuntimeError("результат задачи не записался на диск")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job["attempts"] += 1
+            metrics.inc("jobs.failures")
+            # из окружения здесь, а не при импорте: .env грузится позже
+            if job["attempts"] >= int(os.getenv("JOBS_MAX_ATTEMPTS", "8")):
+                print(f"[jobs] ❌ {job['id']} сдалась после {job['attempts']} попыток: {e}")
+                self._jobs.pop(job["id"], None)
+            else:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (job["attempts"] - 1))
+                job["next_at"] = time.time() + delay
+                print(f"[jobs] ⚠️ {job['id']} упала ({e}), повтор через {delay:.0f} с")
+        else:
+            metrics.inc("jobs.done")
+            self._jobs.pop(job["id"], None)
+        finally:
+            metrics.observe_ms(f"jobs.{job['kind']}", (time.perf_counter() - start) * 1000)
+        self._persist()
+
+    async def _work(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            due = [j for j in self._jobs.values() if j["next_at"] <= now]
+            if due:
+                await self._run_job(min(due, key=lambda j: j["next_at"]))
+                continue
+
+            timeout = None
+            if self._jobs:
+                timeout = max(0.0, min(j["next_at"] for j in self._jobs.values()) - now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Поднять задачи из журнала и запустить воркер (из on_startup)."""
+        self._load()
+        self._wakeup = asyncio.Event()
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._work())
+
+    async def stop(self):
+        worker, self._worker = self._worker, None
+        if worker:
+            worker.cancel()
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+
+
+jobs = JobQueue()
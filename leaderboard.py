@@ -0,0 +1,125 @@
+# leaderboard.py
+"""
+Рейтинги культа и ФБР для /очки, без сортировки на каждый запрос.
+
+Каждая доска — отсортированный список пар (-очки, user_id) плюс словарь
+user_id -> очки. Изменение очков или команды игрока переставляет только его
+(поиск места — bisect), топ — срез списка, «моё место» — один bisect.
+
+В доску ФБР попадают все агенты (и с нулём очков), в доску культа — все, у
+кого есть очки и кто не в ФБР. Очки меняются через shared.add_score /
+shared.set_score, смена команды — через leaderboard.update(user_id).
+
+Готовый текст топа кэшируется в самой доске (Board.rendered) и
+перерисовывается, только когда изменилось что-то в первых TOP_N местах.
+Попадания и промахи — метрики leaderboard.<доска>.cache_hits / cache_misses.
+"""
+import bisect
+
+from store import store
+import metrics
+
+TOP_N = 10
+
+
+class Board:
+    def __init__(self, name):
+        self.name = name
+        self._keys = []     # (-очки, user_id), по возрастанию = по убыванию очков
+        self._scores = {}   # user_id -> очки
+        self.top_version = 0    # растёт при каждом изменении первых TOP_N мест
+        self._rendered = None   # (top_version, текст)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    def set(self, user_id, score):
+        if self._scores.get(user_id) == score:
+            return
+        self.remove(user_id)
+        self._scores[user_id] = score
+        key = (-score, user_id)
+        i = bisect.bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        if i < TOP_N:
+            self.top_version += 1
+
+    def remove(self, user_id):
+        score = self._scores.pop(user_id, None)
+        if score is None:
+            return
+        i = bisect.bisect_left(self._keys, (-score, user_id))
+        del self._keys[i]
+        if i < TOP_N:
+            self.top_version += 1
+
+    def top(self, n=10):
+        """[(user_id, очки)] — первые n мест."""
+        return [(uid, -neg) for neg, uid in self._keys[:n]]
+
+    def rank(self, user_id):
+        """Место игрока (с 1) или None, если его нет в доске."""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self._keys, (-score, user_id)) + 1
+
+    def score(self, user_id):
+        return self._scores.get(user_id, 0)
+
+    def rendered(self, render):
+        """Текст топа: render(top(TOP_N)) — из кэша, пока топ не менялся."""
+        if self._rendered is not None and self._rendered[0] == self.top_version:
+            metrics.inc(f"leaderboard.{self.name}.cache_hits")
+            return self._rendered[1]
+        metrics.inc(f"leaderboard.{self.name}.cache_misses")
+        text = render(self.top(TOP_N))
+        self._rendered = (self.top_version, text)
+        return text
+
+
+class Leaderboard:
+    def __init__(self):
+        self.boards = None   # "cult" / "fbi" -> Board, строятся при первом обращении
+
+    def _team(self, user_id):
+        pdata = store.get("players").get(user_id)
+        return pdata.get("team") if isinstance(pdata, dict) else None
+
+    def _build(self):
+        self.boards = {"cult": Board("cult"), "fbi": Board("fbi")}
+        scores = store.get("scores")
+        for uid, pdata in store.get("players").items():
+            if isinstance(pdata, dict) and pdata.get("team") == "fbi":
+                self.boards["fbi"].set(uid, scores.get(uid, 0))
+        for uid, score in scores.items():
+            if uid not in self.boards["fbi"]:
+                self.boards["cult"].set(uid, score)
+
+    def board(self, name):
+        if self.boards is None:
+            self._build()
+        return self.boards[name]
+
+    def update(self, user_id):
+        """Переставить игрока после изменения его очков или команды."""
+        if self.boards is None:
+            self._build()
+            return
+        user_id = str(user_id)
+        scores = store.get("scores")
+        if self._team(user_id) == "fbi":
+            self.boards["cult"].remove(user_id)
+            self.boards["fbi"].set(user_id, scores.get(user_id, 0))
+        else:
+            self.boards["fbi"].remove(user_id)
+            if user_id in scores:
+                self.boards["cult"].set(user_id, scores[user_id])
+            else:
+                self.boards["cult"].remove(user_id)
+
+
+leaderboard = Leaderboard()
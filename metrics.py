@@ -0,0 +1,66 @@
+# metrics.py
+"""
+Простые метрики в памяти процесса: счётчики, текущие значения и тайминги.
+Смотреть — командой /metrics у админа.
+Обновляются и из потоков пулов (например, qr_tools), поэтому под замком.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+_counters = defaultdict(int)
+_gauges = {}
+_timings = {}  # имя -> [count, total_ms, max_ms]
+_lock = threading.Lock()
+
+
+def inc(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe_ms(name, ms):
+    with _lock:
+        t = _timings.setdefault(name, [0, 0.0, 0.0])
+        t[0] += 1
+        t[1] += ms
+        t[2] = max(t[2], ms)
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_ms(name, (time.perf_counter() - start) * 1000)
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": {
+                name: {"count": c, "avg_ms": total / c if c else 0.0, "max_ms": mx}
+                for name, (c, total, mx) in _timings.items()
+            },
+        }
+
+
+def render():
+    snap = snapshot()
+    lines = []
+    for name, value in sorted(snap["counters"].items()):
+        lines.append(f"{name}: {value}")
+    for name, value in sorted(snap["gauges"].items()):
+        lines.append(f"{name}: {value}")
+    for name, t in sorted(snap["timings"].items()):
+        lines.append(f"{name}: n={t['count']} avg={t['avg_ms']:.1f}ms max={t['max_ms']:.1f}ms")
+    return "\n".join(lines) or "Метрик пока нет."
@@ -0,0 +1,224 @@
+# moderation.py
+"""
+Отправка отчётов на модерацию в контрол-чат.
+
+mod_id отчёта выдаётся локально ещё до отправки, поэтому кнопки
+«Принять/Отклонить» уходят в том же вызове, что и фото, — без второго
+edit_message_reply_markup. Кнопки несут mod_id, запись в pending_store — тоже.
+
+MODERATION_BATCH > 1 включает пакетный режим: отчёты копятся, пока их не
+наберётся MODERATION_BATCH (не больше 10 — предел альбома) или не пройдёт
+MODERATION_BATCH_WINDOW секунд, и уходят одним альбомом плюс одно сообщение
+с кнопками по каждому отчёту. Если альбом не ушёл, отчёты пакета шлются по
+одному — один плохой отчёт не держит очередь; отчёт без читаемого фото
+выбрасывается из очереди (запись в pending остаётся).
+"""
+import asyncio
+import io
+import os
+import secrets
+from pathlib import Path
+
+from aiogram import types
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from store import store
+from pending_store import pending_store
+import metrics
+
+
+# настройки читаются при использовании: при импорте модуля .env ещё не загружен
+def _batch_size():
+    return max(1, min(10, int(os.getenv("MODERATION_BATCH", "1"))))
+
+
+def _batch_window():
+    return float(os.getenv("MODERATION_BATCH_WINDOW", "15"))
+
+
+def new_mod_id():
+    # буква в начале — чтобы не спутать со старыми кнопками, где стоит message_id
+    return f"m{secrets.token_hex(5)}"
+
+
+def report_caption(entry):
+    return (
+        f"🧾 Отчёт от @{entry.get('username')}\n"
+        f"Жертва: {entry.get('victim_name')}\n"
+        f"Ритуал: {entry.get('ritual')}\n"
+        f"Орудие: {entry.get('weapon_id')}\n"
+        f"Место: {entry.get('place')}"
+    )
+
+
+def report_keyboard(mod_id):
+    kb = InlineKeyboardMarkup(row_width=2)
+    kb.add(
+        InlineKeyboardButton("✅ Принять", callback_data=f"accept:{mod_id}"),
+        InlineKeyboardButton("❌ Отклонить", callback_data=f"reject:{mod_id}")
+    )
+    return kb
+
+
+def _photo_readable(entry):
+    path = entry.get("photo_path")
+    return bool(path) and Path(path).is_file() and os.access(path, os.R_OK)
+
+
+def _input_file(path):
+    path = Path(path)
+    return types.InputFile(io.BytesIO(path.read_bytes()), filename=path.name)
+
+
+async def mark_decided(message, key, mark):
+    """
+    Отметить решение в контрол-чате: у одиночного отчёта — дописать в подпись,
+    в пакете — убрать кнопки этого отчёта и дописать строку в текст.
+    """
+    if message.photo:
+        await message.edit_caption((message.caption or "") + f"\n{mark}")
+        return
+
+    rows, label = [], None
+    markup = message.reply_markup
+    for row in (markup.inline_keyboard if markup else []):
+        if any((b.callback_data or "").endswith(f":{key}") for b in row):
+            label = row[0].text.split()[-1]
+        else:
+            rows.append(row)
+    text = message.text or ""
+    if label:
+        text += f"\n{label}: {mark}"
+    await message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+
+
+class ModerationQueue:
+    def __init__(self):
+        self.bot = None
+        self.chat_id = None
+        self._batch = []    # записи pending, ждущие отправки
+        self._timer = None
+
+    async def _bind(self, message_ids):
+        """Запомнить message_id отправленных отчётов (mod_id -> message_id)."""
+        async with store.locked("pending"):
+            for mod_id, message_id in message_ids.items():
+                entry = pending_store.get(mod_id)
+                if entry is not None:
+                    entry["message_id"] = message_id
+                    pending_store.update(entry)
+
+    async def _send_one(self, entry):
+        sent = await self.bot.send_photo(
+            self.chat_id,
+            photo=_input_file(entry["photo_path"]),
+            caption=report_caption(entry),
+            reply_markup=report_keyboard(entry["mod_id"]),
+        )
+        metrics.inc("moderation.sent")
+        return {entry["mod_id"]: sent.message_id}
+
+    async def _send_batch(self, batch):
+        if len(batch) == 1:  # альбом из одного фото Telegram не принимает
+            return await self._send_one(batch[0])
+
+        media = types.MediaGroup()
+        for n, entry in enumerate(batch, 1):
+            media.attach_photo(_input_file(entry["photo_path"]), f"#{n}\n{report_caption(entry)}")
+        album = await self.bot.send_media_group(self.chat_id, media)
+
+        kb = InlineKeyboardMarkup(row_width=2)
+        lines = [f"🗂 Отчёты на проверку: {len(batch)}"]
+        for n, entry in enumerate(batch, 1):
+            kb.row(
+                InlineKeyboardButton(f"✅ #{n}", callback_data=f"accept:{entry['mod_id']}"),
+                InlineKeyboardButton(f"❌ #{n}", callback_data=f"reject:{entry['mod_id']}"),
+            )
+            lines.append(f"#{n} @{entry.get('username')} — {entry.get('victim_name')}, {entry.get('weapon_id')}")
+        await self.bot.send_message(
+            self.chat_id, "\n".join(lines),
+            reply_to_message_id=album[0].message_id, reply_markup=kb
+        )
+        metrics.inc("moderation.sent", len(batch))
+        metrics.inc("moderation.batches")
+        return {entry["mod_id"]: msg.message_id for entry, msg in zip(batch, album)}
+
+    async def _send_each(self, batch):
+        """Пакет не ушёл — шлём отчёты по одному; вернуть те, что не ушли и так."""
+        failed = []
+        for entry in batch:
+            try:
+                await self._bind(await self._send_one(entry))
+            except Exception as e:
+                print(f"[moderation] ⚠️ Не удалось отправить отчёт {entry.get('mod_id')}: {e}")
+                failed.append(entry)
+        return failed
+
+    def _schedule(self):
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(
+                _batch_window(), lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        """Отправить накопленное (по MODERATION_BATCH за раз)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        size = _batch_size()
+        retry = []
+        while self._batch:
+            batch, self._batch = self._batch[:size], self._batch[size:]
+            readable = []
+            for entry in batch:
+                if _photo_readable(entry):
+                    readable.append(entry)
+                else:
+                    print(f"[moderation] ⚠️ Нет фото {entry.get('photo_path')}, отчёт {entry.get('mod_id')} убран из очереди")
+                    metrics.inc("moderation.dropped")
+            batch = readable
+            if not batch:
+                continue
+            try:
+                await self._bind(await self._send_batch(batch))
+                continue
+            except Exception as e:
+                print(f"[moderation] ⚠️ Не удалось отправить пакет отчётов: {e}")
+            retry += await self._send_each(batch) if len(batch) > 1 else batch
+        if retry:
+            self._batch = retry + self._batch
+            self._schedule()
+        metrics.set_gauge("moderation.queued", len(self._batch))
+
+    async def submit(self, entry):
+        """
+        Отправить отчёт (уже записанный в pending) модераторам. В обычном режиме —
+        сразу, ошибка уходит вызывающему; в пакетном — в ближайшем пакете.
+        """
+        size = _batch_size()
+        if size <= 1:
+            await self._bind(await self._send_one(entry))
+            return
+        self._batch.append(entry)
+        metrics.set_gauge("moderation.queued", len(self._batch))
+        if len(self._batch) >= size:
+            await self.flush()
+        else:
+            self._schedule()
+
+    def start(self, bot, chat_id):
+        """Из on_startup: дослать отчёты, не успевшие уйти до рестарта."""
+        self.bot = bot
+        self.chat_id = chat_id
+        stuck = [
+            r for r in pending_store.entries()
+            if r.get("mod_id") and not r.get("message_id") and Path(r.get("photo_path", "")).is_file()
+        ]
+        if stuck:
+            print(f"[moderation] Досылаем отчётов после рестарта: {len(stuck)}")
+            self._batch.extend(stuck)
+            self._schedule()
+
+
+moderation = ModerationQueue()
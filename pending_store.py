@@ -0,0 +1,230 @@
+# pending_store.py
+"""
+Отчёты, ждущие модерации, — с индексами в памяти.
+
+Записи лежат в словаре по ключу модерации (mod_id, у старых записей —
+message_id) и в словаре по паре (user_id, victim_id), так что поиск по кнопке
+и проверка «уже отправлял отчёт» не перебирают весь список.
+
+На диск пишется не весь список, а по одной операции:
+  - json (по умолчанию) — журнал LOG_FILE, строка JSON на операцию
+    (put/del); при загрузке журнал проигрывается и, если в нём накопилось
+    много удалённого, переписывается начисто;
+  - sqlite (STORAGE_BACKEND=sqlite) — INSERT/DELETE одной строки таблицы
+    pending_reports той же базы, что у store.
+
+Старый pending_reports.json переносится при первом запуске и
+переименовывается в pending_reports.json.migrated — только если в нём есть
+записи: пустой файл (он лежит в git) остаётся на месте.
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from store import store
+
+LOG_FILE = Path("pending_reports.jsonl")
+LEGACY_FILE = Path("pending_reports.json")
+COMPACT_MIN_LINES = 200  # меньше этого журнал не переписываем
+
+
+def pending_key(entry):
+    # новые отчёты получают mod_id ещё до отправки модераторам
+    return str(entry.get("mod_id") or entry.get("message_id"))
+
+
+def _pair(user_id, victim_id):
+    return (str(user_id), str(victim_id))
+
+
+def read_legacy_json(path):
+    if not path.exists():
+        return []
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        print(f"[pending] ⚠️ Ошибка чтения {path}: {e}")
+        return []
+    return data if isinstance(data, list) else []
+
+
+class JsonlLog:
+    """Журнал операций: {"op": "put", "entry": {...}} / {"op": "del", "key": "..."}."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def load(self):
+        entries, lines = {}, 0
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    lines += 1
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # недописанная строка после падения — пропускаем
+                        print(f"[pending] ⚠️ Битая строка в {self.path}, пропускаю")
+                        continue
+                    if op.get("op") == "put":
+                        entries[pending_key(op["entry"])] = op["entry"]
+                    elif op.get("op") == "del":
+                        entries.pop(op.get("key"), None)
+        if lines > max(COMPACT_MIN_LINES, 2 * len(entries)):
+            self.rewrite(entries.values())
+        return list(entries.values())
+
+    def rewrite(self, entries):
+        fd, tmp = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix=".tmp", dir=self.path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for entry in entries:
+                    f.write(json.dumps({"op": "put", "entry": entry}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _append(self, op):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def put(self, entry):
+        self._append({"op": "put", "entry": entry})
+
+    def delete(self, key):
+        self._append({"op": "del", "key": key})
+
+
+class SqliteLog:
+    """Строки таблицы pending_reports (столбец message_id хранит ключ модерации)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def load(self):
+        cur = self.conn.execute("SELECT data FROM pending_reports ORDER BY rowid")
+        return [json.loads(data) for (data,) in cur]
+
+    INSERT = "INSERT OR REPLACE INTO pending_reports (message_id, user_id, victim_id, data) VALUES (?, ?, ?, ?)"
+
+    @staticmethod
+    def _row(entry):
+        user_id = entry.get("user_id")
+        return (
+            pending_key(entry),
+            user_id if isinstance(user_id, int) else None,
+            str(entry.get("victim_id")),
+            json.dumps(entry, ensure_ascii=False, sort_keys=True),
+        )
+
+    def rewrite(self, entries):
+        with self.conn:
+            self.conn.execute("DELETE FROM pending_reports")
+            self.conn.executemany(self.INSERT, [self._row(e) for e in entries])
+
+    def put(self, entry):
+        with self.conn:
+            self.conn.execute(self.INSERT, self._row(entry))
+
+    def delete(self, key):
+        with self.conn:
+            self.conn.execute("DELETE FROM pending_reports WHERE message_id = ?", (key,))
+
+
+class PendingStore:
+    def __init__(self, log_path=LOG_FILE, legacy_path=LEGACY_FILE):
+        self.log_path = Path(log_path)
+        self.legacy_path = Path(legacy_path)
+        self._log = None
+        self._by_key = None   # ключ модерации -> запись (в порядке поступления)
+        self._by_pair = {}    # (user_id, victim_id) -> ключ модерации
+
+    def _open_log(self):
+        # бэкенд тот же, что у store; выбираем лениво — .env грузится после импорта
+        conn = getattr(store.backend, "conn", None)
+        if conn is not None:
+            return SqliteLog(conn)
+        return JsonlLog(self.log_path)
+
+    def _load(self):
+        if self._by_key is not None:
+            return
+        self._log = self._open_log()
+        entries = self._log.load()
+        legacy = read_legacy_json(self.legacy_path) if not entries else []
+        if legacy:
+            entries = legacy
+            self._log.rewrite(entries)
+            self.legacy_path.replace(self.legacy_path.with_name(self.legacy_path.name + ".migrated"))
+            print(f"[pending] Перенесено из {self.legacy_path}: {len(entries)}")
+        self._by_key, self._by_pair = {}, {}
+        for entry in entries:
+            self._index(entry)
+
+    def _index(self, entry):
+        key = pending_key(entry)
+        self._by_key[key] = entry
+        self._by_pair[_pair(entry.get("user_id"), entry.get("victim_id"))] = key
+        return key
+
+    def entries(self):
+        self._load()
+        return list(self._by_key.values())
+
+    def get(self, key):
+        """Запись по ключу из кнопки модерации или None."""
+        self._load()
+        return self._by_key.get(str(key))
+
+    def exists(self, user_id, victim_id):
+        """Есть ли у игрока отчёт по этой жертве, ждущий проверки."""
+        self._load()
+        return _pair(user_id, victim_id) in self._by_pair
+
+    def add(self, entry):
+        """Добавить запись. False — если от игрока уже ждёт отчёт по этой жертве."""
+        self._load()
+        if self.exists(entry.get("user_id"), entry.get("victim_id")):
+            return False
+        self._index(entry)
+        self._log.put(entry)
+        return True
+
+    def update(self, entry):
+        """Сохранить изменения уже добавленной записи (например, message_id)."""
+        self._load()
+        self._index(entry)
+        self._log.put(entry)
+
+    def remove(self, key):
+        """Убрать запись по ключу модерации; вернуть её или None."""
+        self._load()
+        entry = self._by_key.pop(str(key), None)
+        if entry is None:
+            return None
+        pair = _pair(entry.get("user_id"), entry.get("victim_id"))
+        if self._by_pair.get(pair) == str(key):
+            del self._by_pair[pair]
+        self._log.delete(str(key))
+        return entry
+
+    def start(self):
+        """Загрузить записи заранее (из on_startup, после store.start())."""
+        self._load()
+        print(f"[pending] Ожидают проверки: {len(self._by_key)}")
+
+
+pending_store = PendingStore()
@@ -0,0 +1,58 @@
+# photo_cache.py
+"""
+Одно скачивание фото на один апдейт.
+
+QR-хендлер и handle_report смотрят на одно и то же фото: первый скачивает его,
+второй получает те же байты из кэша апдейта (ключ — file_unique_id).
+Кэш живёт в data апдейта, его заводит PhotoCacheMiddleware.
+"""
+import asyncio
+import io
+import time
+
+from aiogram.dispatcher.handler import ctx_data
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import metrics
+
+DATA_KEY = "photo_cache"
+
+
+async def download_photo(photo) -> bytes:
+    """Скачать фото из Telegram в память (без записи на диск)."""
+    start = time.perf_counter()
+    buf = io.BytesIO()
+    await photo.download(destination_file=buf)
+    data = buf.getvalue()
+    metrics.observe_ms("photo.download", (time.perf_counter() - start) * 1000)
+    metrics.inc("photo.downloads")
+    metrics.inc("photo.bytes", len(data))
+    return data
+
+
+async def get_photo_bytes(photo) -> bytes:
+    """Байты фото; в пределах одного апдейта качаются один раз."""
+    data = ctx_data.get(None)
+    cache = data.get(DATA_KEY) if data is not None else None
+    if cache is None:
+        return await download_photo(photo)
+
+    key = photo.file_unique_id
+    task = cache.get(key)
+    if task is None:
+        task = asyncio.ensure_future(download_photo(photo))
+        cache[key] = task
+    else:
+        metrics.inc("photo.cache_hits")
+    try:
+        return await task
+    except Exception:
+        cache.pop(key, None)
+        raise
+
+
+class PhotoCacheMiddleware(BaseMiddleware):
+    """Заводит пустой кэш фото на каждый входящий message."""
+
+    async def on_pre_process_message(self, message, data: dict):
+        data[DATA_KEY] = {}
@@ -1,10 +1,67 @@
+import asyncio
+import multiprocessing
 import cv2
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
 from datetime import datetime, timedelta
 TZ_OFFSET = timedelta(hours=3)
 import os
 
+FONT_PATH = os.path.join("fonts", "PressStart2P-Regular.ttf")
+# Пул заранее сгенерированных плиток шума: каждая чуть больше кадра,
+# на каждое фото берётся случайная плитка со случайным сдвигом и отражением.
+# Память: PHOTO_NOISE_TILES × (600+PAD) × (800+PAD) × 3 × 2 байта (~3.4 МБ на плитку).
+
+_noise_pool = {}  # форма кадра -> список плиток int16
+
+# Обфускация — чистый CPU, поэтому для бота она идёт в пуле процессов
+# (PHOTO_WORKERS штук, по умолчанию 2; читается при создании пула).
+_process_pool = None
+
+@lru_cache(maxsize=1)
+def _noise_settings():
+    """(число плиток, запас PAD) — из окружения при первом фото: при импорте .env ещё не загружен."""
+    return int(os.getenv("PHOTO_NOISE_TILES", "4")), int(os.getenv("PHOTO_NOISE_PAD", "64"))
+
+@lru_cache(maxsize=4)
+def _font(size):
+    try:
+        return ImageFont.truetype(FONT_PATH, size)
+    except:
+        return ImageFont.load_default()
+
+def _noise(shape):
+    """Шум N(0, 80) формы shape (int16) — вид на плитку из пула, без новых аллокаций."""
+    h, w, c = shape
+    max_tiles, pad = _noise_settings()
+    tiles = _noise_pool.setdefault(shape, [])
+    if len(tiles) < max(1, max_tiles):
+        tile = np.random.normal(0, 80, (h + pad, w + pad, c)).astype(np.int16)
+        tiles.append(tile)
+    else:
+        tile = tiles[np.random.randint(len(tiles))]
+    dy, dx = np.random.randint(0, pad + 1, size=2)
+    view = tile[dy:dy + h, dx:dx + w]
+    if np.random.randint(2):
+        view = view[::-1]
+    if np.random.randint(2):
+        view = view[:, ::-1]
+    return view
+
+@lru_cache(maxsize=4)
+def _wave_columns(height, width):
+    """
+    Карта столбцов для волны: строка y сдвигается на int(15·sin(2πy/80)),
+    ровно как np.roll(img[y], shift). Считается один раз на размер кадра.
+    """
+    shifts = np.array([int(15.0 * np.sin(2 * np.pi * y / 80)) for y in range(height)])
+    cols = (np.arange(width)[None, :] - shifts[:, None]) % width
+    cols.setflags(write=False)
+    return cols[:, :, None]
+
 def ultra_obscured_version(input_path):
     """
     Делает искажённую версию фото с таймстампом из времени модификации.
@@ -22,14 +79,11 @@ def ultra_obscured_version(input_path):
     # 2. Сильное размытие
     img = cv2.GaussianBlur(img, (21, 21), 5)
 
-    # 3. Шум
-    noise = np.random.normal(0, 80, img.shape).astype(np.int16)
-    img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    # 3. Шум (из пула плиток)
+    img = np.clip(img.astype(np.int16) + _noise(img.shape), 0, 255).astype(np.uint8)
 
-    # 4. Волновое искажение
-    for y in range(img.shape[0]):
-        shift = int(15.0 * np.sin(2 * np.pi * y / 80))
-        img[y] = np.roll(img[y], shift, axis=0)
+    # 4. Волновое искажение — все строки одним сдвигом по готовой карте
+    img = np.take_along_axis(img, _wave_columns(*img.shape[:2]), axis=1)
 
     # Перевод в PIL и добавление таймстампа
     img_pil = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
@@ -43,15 +97,49 @@ def ultra_obscured_version(input_path):
     except:
         timestamp = "????-??-?? ??:??:??"
 
-    try:
-        font_path = os.path.join("fonts", "PressStart2P-Regular.ttf")
-        font = ImageFont.truetype(font_path, 28)
-    except:
-        font = ImageFont.load_default()
+    font = _font(28)
 
     draw.text((20, img_pil.height - 60), timestamp, fill=(255, 255, 255), font=font)
 
     output_path = os.path.splitext(input_path)[0] + "_distorted.jpg"
     img_pil.save(output_path, "JPEG")
     print(f"[photo_tools] ✅ Сохранено: {output_path}")
-    return output_path
\ No newline at end of file
+    return output_path
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # spawn: в боте уже крутятся потоки (QR-пул), fork с ними небезопасен
+        _process_pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("PHOTO_WORKERS", "2")),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _process_pool
+
+def _drop_broken_pool(pool):
+    global _process_pool
+    if _process_pool is pool:  # параллельный вызов мог уже пересоздать пул
+        _process_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+async def ultra_obscured_version_async(input_path):
+    """
+    То же, что ultra_obscured_version, но в пуле процессов — loop не блокируется.
+    Если воркер умер (например, OOM killer) и пул сломан — пересоздаём его и
+    пробуем ещё раз.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, ultra_obscured_version, str(input_path))
+    except BrokenProcessPool:
+        print("[photo_tools] ⚠️ Пул процессов сломан, пересоздаю")
+        _drop_broken_pool(pool)
+        return await loop.run_in_executor(_get_process_pool(), ultra_obscured_version, str(input_path))
+
+def shutdown_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
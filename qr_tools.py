@@ -0,0 +1,199 @@
+# qr_tools.py
+"""
+Распознавание QR вне event loop.
+
+Картинка приходит байтами прямо из памяти (см. photo_cache) и
+разжимается cv2.imdecode — без временных файлов в tmp/. Разжатие и
+QRCodeDetector занимают десятки-сотни миллисекунд, поэтому всё это идёт
+в ограниченном пуле потоков (OpenCV отпускает GIL), а хендлеры просто
+ждут результат. Настройки:
+  QR_WORKERS — число потоков (по умолчанию 2),
+  QR_TIMEOUT — сколько ждать результат, сек (по умолчанию 5),
+  QR_WECHAT_MODEL_DIR — папка с моделями WeChat (detect/sr .prototxt/.caffemodel).
+
+Распознавание идёт по ступеням, от дешёвой к дорогой, до первого успеха:
+  fast      — уменьшенная серая копия, обычный detectAndDecode;
+  multi     — полный размер, detectAndDecodeMulti;
+  threshold — адаптивный порог (спасает размытые и тёмные снимки);
+  wechat    — CNN-детектор WeChat, если OpenCV собран с contrib.
+Дорогие ступени (threshold, wechat) запускаются, только если дешёвые нашли
+на кадре хоть что-то похожее на QR, но не смогли его прочитать. Обычный
+отчёт — фото без QR — на этом и заканчивается (метрика qr.early_exits).
+По каждой ступени считаются попадания и время (метрики qr.tier.*).
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import metrics
+
+# значения по умолчанию; из окружения их читает _get_executor() —
+# при импорте .env ещё не подгружен
+QR_WORKERS = 2
+QR_TIMEOUT = 5.0
+QR_WECHAT_MODEL_DIR = ""
+FAST_MAX_SIDE = 800  # px, до какого размера ужимаем кадр для первой ступени
+
+_executor = None
+_in_flight = 0
+
+
+def _get_executor():
+    global _executor, QR_WORKERS, QR_TIMEOUT, QR_WECHAT_MODEL_DIR
+    if _executor is None:
+        QR_WORKERS = int(os.getenv("QR_WORKERS", "2"))
+        QR_TIMEOUT = float(os.getenv("QR_TIMEOUT", "5"))
+        QR_WECHAT_MODEL_DIR = os.getenv("QR_WECHAT_MODEL_DIR", "")
+        _executor = ThreadPoolExecutor(max_workers=QR_WORKERS, thread_name_prefix="qr")
+    return _executor
+
+
+def _load_image(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(str(source))
+
+
+# детекторы не потокобезопасны — у каждого потока пула свои
+_local = threading.local()
+
+
+def _detector():
+    if not hasattr(_local, "detector"):
+        _local.detector = cv2.QRCodeDetector()
+    return _local.detector
+
+
+def _wechat_detector():
+    if not hasattr(_local, "wechat"):
+        _local.wechat = None
+        if hasattr(cv2, "wechat_qrcode_WeChatQRCode"):
+            try:
+                if QR_WECHAT_MODEL_DIR:
+                    d = QR_WECHAT_MODEL_DIR
+                    _local.wechat = cv2.wechat_qrcode_WeChatQRCode(
+                        os.path.join(d, "detect.prototxt"), os.path.join(d, "detect.caffemodel"),
+                        os.path.join(d, "sr.prototxt"), os.path.join(d, "sr.caffemodel"),
+                    )
+                else:
+                    _local.wechat = cv2.wechat_qrcode_WeChatQRCode()
+            except Exception as e:
+                print(f"[qr] ⚠️ WeChat-детектор недоступен: {e}")
+    return _local.wechat
+
+
+# каждая ступень возвращает (текст или None, нашёлся ли на кадре кандидат в QR)
+
+def _tier_fast(gray):
+    h, w = gray.shape[:2]
+    scale = FAST_MAX_SIDE / max(h, w)
+    if scale < 1:
+        gray = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    data, points, _ = _detector().detectAndDecode(gray)
+    return data, points is not None
+
+
+def _tier_multi(gray):
+    ok, decoded, _, _ = _detector().detectAndDecodeMulti(gray)
+    if ok:
+        return next((d for d in decoded if d), None), True
+    return None, False
+
+
+def _tier_threshold(gray):
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 5)
+    data, points, _ = _detector().detectAndDecode(binary)
+    return data, points is not None
+
+
+def _tier_wechat(gray):
+    detector = _wechat_detector()
+    if detector is None:
+        return None, False
+    decoded, points = detector.detectAndDecode(gray)
+    return next((d for d in decoded if d), None), bool(points)
+
+
+# (имя, функция, дешёвая ли)
+TIERS = (
+    ("fast", _tier_fast, True),
+    ("multi", _tier_multi, True),
+    ("threshold", _tier_threshold, False),
+    ("wechat", _tier_wechat, False),
+)
+
+
+def decode_qr_sync(source):
+    """
+    Синхронно: текст из QR или None. source — байты картинки или путь к файлу.
+    Выполняется в потоке пула.
+    """
+    start = time.perf_counter()
+    try:
+        img = _load_image(source)
+        if img is None:
+            return None
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        located = False
+        for name, tier, cheap in TIERS:
+            if not cheap and not located:
+                # дешёвые ступени не нашли на кадре ничего похожего на QR
+                metrics.inc("qr.early_exits")
+                break
+            tier_start = time.perf_counter()
+            try:
+                data, found = tier(gray)
+            except cv2.error as e:
+                print(f"[qr] ⚠️ Ступень {name} упала: {e}")
+                data, found = None, False
+            located = located or found
+            metrics.observe_ms(f"qr.tier.{name}", (time.perf_counter() - tier_start) * 1000)
+            if data:
+                metrics.inc(f"qr.tier.{name}.hits")
+                return data
+        metrics.inc("qr.misses")
+        return None
+    finally:
+        metrics.observe_ms("qr.decode", (time.perf_counter() - start) * 1000)
+
+
+async def decode_qr(source):
+    """
+    Текст из QR (байты картинки или путь) или None, в том числе по таймауту.
+    Таймаут только перестаёт ждать: прервать вызов OpenCV нельзя, так что
+    поток пула дорабатывает кадр в фоне и лишь потом берёт следующий.
+    Работа на кадр ограничена ступенями (см. выше), очередь — QR_WORKERS.
+    """
+    global _in_flight
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    _in_flight += 1
+    metrics.set_gauge("qr.queue_depth", max(0, _in_flight - QR_WORKERS))
+    start = time.perf_counter()
+    try:
+        fut = loop.run_in_executor(executor, decode_qr_sync, source)
+        return await asyncio.wait_for(fut, QR_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.inc("qr.timeouts")
+        print(f"[qr] ⏱ Распознавание не уложилось в {QR_TIMEOUT} с")
+        return None
+    except Exception as e:
+        metrics.inc("qr.errors")
+        print(f"[qr] ⚠️ Ошибка распознавания: {e}")
+        return None
+    finally:
+        _in_flight -= 1
+        metrics.set_gauge("qr.queue_depth", max(0, _in_flight - QR_WORKERS))
+        metrics.observe_ms("qr.total", (time.perf_counter() - start) * 1000)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
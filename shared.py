@@ -1,6 +1,8 @@
 
 import json
 from pathlib import Path
+from store import store
+from leaderboard import leaderboard
 
 PLAYERS_FILE = Path("players.json")
 REPORT_FILE = Path("ritual_reports.json")
@@ -23,16 +25,27 @@ def load_rituals():
     return []
 
 def load_players():
-    if PLAYERS_FILE.exists():
-        with open(PLAYERS_FILE, encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    return store.get("players")
 
 def load_all_reports():
-    if REPORT_FILE.exists():
-        with open(REPORT_FILE, encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    return store.get("reports")
+
+def add_score(user_id, delta):
+    """Прибавить очки игроку (delta может быть < 0), вернуть новый счёт.
+    Без await — вызывать под store.locked("scores")."""
+    scores = store.get("scores")
+    new_score = scores.get(str(user_id), 0) + delta
+    scores[str(user_id)] = new_score
+    store.set("scores", scores)
+    leaderboard.update(user_id)
+    return new_score
+
+def set_score(user_id, value):
+    """Выставить счёт игрока. Без await — вызывать под store.locked("scores")."""
+    scores = store.get("scores")
+    scores[str(user_id)] = value
+    store.set("scores", scores)
+    leaderboard.update(user_id)
 
 def load_victims():
     if VICTIMS_FILE.exists():
@@ -0,0 +1,257 @@
+# storage_sqlite.py
+"""
+SQLite-бэкенд для store.py (STORAGE_BACKEND=sqlite).
+
+Игроки, очки, принятые отчёты, дела ФБР и попытки по делам
+лежат в отдельных индексированных таблицах (ожидающие отчёты — тоже, но их
+построчно пишет pending_store.py). При сохранении бэкенд сравнивает
+новые данные с тем, что уже в базе, и пишет только изменившиеся строки —
+стоимость записи больше не растёт вместе с историей игры.
+
+Разовый перенос существующих JSON-файлов в базу:
+    python storage_sqlite.py [путь_к_базе]
+"""
+import json
+import sqlite3
+import sys
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    user_id TEXT PRIMARY KEY,
+    team    TEXT,
+    data    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_players_team ON players(team);
+
+CREATE TABLE IF NOT EXISTS scores (
+    user_id TEXT PRIMARY KEY,
+    score   INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scores_score ON scores(score);
+
+CREATE TABLE IF NOT EXISTS report_victims (
+    victim_id TEXT PRIMARY KEY,
+    data      TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    victim_id    TEXT NOT NULL,
+    report_index INTEGER NOT NULL,
+    user_id      INTEGER,
+    data         TEXT NOT NULL,
+    PRIMARY KEY (victim_id, report_index)
+);
+CREATE INDEX IF NOT EXISTS idx_reports_user ON reports(user_id);
+
+CREATE TABLE IF NOT EXISTS pending_reports (
+    message_id TEXT PRIMARY KEY,
+    user_id    INTEGER,
+    victim_id  TEXT,
+    data       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pending_user_victim ON pending_reports(user_id, victim_id);
+
+CREATE TABLE IF NOT EXISTS cases (
+    case_id      TEXT PRIMARY KEY,
+    victim_id    TEXT,
+    report_index INTEGER,
+    status       TEXT,
+    data         TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cases_victim ON cases(victim_id, report_index);
+CREATE INDEX IF NOT EXISTS idx_cases_status ON cases(status);
+
+CREATE TABLE IF NOT EXISTS case_attempts (
+    case_id       TEXT NOT NULL,
+    attempt_index INTEGER NOT NULL,
+    agent_id      INTEGER,
+    data          TEXT NOT NULL,
+    PRIMARY KEY (case_id, attempt_index)
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_agent ON case_attempts(agent_id);
+"""
+
+# таблица -> (ключевые колонки, все колонки)
+TABLES = {
+    "players": (("user_id",), ("user_id", "team", "data")),
+    "scores": (("user_id",), ("user_id", "score")),
+    "report_victims": (("victim_id",), ("victim_id", "data")),
+    "reports": (("victim_id", "report_index"), ("victim_id", "report_index", "user_id", "data")),
+    "cases": (("case_id",), ("case_id", "victim_id", "report_index", "status", "data")),
+    "case_attempts": (("case_id", "attempt_index"), ("case_id", "attempt_index", "agent_id", "data")),
+}
+
+# ресурс store -> таблицы, в которых он живёт
+RESOURCE_TABLES = {
+    "players": ("players",),
+    "scores": ("scores",),
+    "reports": ("report_victims", "reports"),
+    "cases": ("cases", "case_attempts"),
+}
+
+
+def _dump(obj):
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True)
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# ==== ресурс -> строки таблиц ====
+
+def _rows_players(players):
+    rows = {}
+    for uid, pdata in players.items():
+        team = pdata.get("team") if isinstance(pdata, dict) else None
+        rows[(str(uid),)] = (str(uid), team, _dump(pdata))
+    return {"players": rows}
+
+
+def _rows_scores(scores):
+    return {"scores": {(str(uid),): (str(uid), score) for uid, score in scores.items()}}
+
+
+def _rows_reports(all_reports):
+    victims, reports = {}, {}
+    for vid, block in all_reports.items():
+        head = {k: v for k, v in block.items() if k != "reports"}
+        victims[(str(vid),)] = (str(vid), _dump(head))
+        for idx, rep in enumerate(block.get("reports", [])):
+            reports[(str(vid), idx)] = (str(vid), idx, _int_or_none(rep.get("user_id")), _dump(rep))
+    return {"report_victims": victims, "reports": reports}
+
+
+def _rows_cases(cases):
+    case_rows, attempt_rows = {}, {}
+    for case in cases:
+        cid = str(case.get("case_id"))
+        head = {k: v for k, v in case.items() if k != "attempts"}
+        case_rows[(cid,)] = (
+            cid, str(case.get("victim_id")), _int_or_none(case.get("report_index")),
+            case.get("status"), _dump(head)
+        )
+        for idx, attempt in enumerate(case.get("attempts", [])):
+            attempt_rows[(cid, idx)] = (cid, idx, _int_or_none(attempt.get("agent_id")), _dump(attempt))
+    return {"cases": case_rows, "case_attempts": attempt_rows}
+
+
+TO_ROWS = {
+    "players": _rows_players,
+    "scores": _rows_scores,
+    "reports": _rows_reports,
+    "cases": _rows_cases,
+}
+
+
+class SqliteBackend:
+    """Бэкенд для store.StateStore. Ресурсы вне RESOURCE_TABLES уходят в fallback."""
+
+    def __init__(self, db_path, fallback=None):
+        self.db_path = str(db_path)
+        self.fallback = fallback
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # то, что сейчас лежит в базе: таблица -> {ключ: строка}
+        self._snapshot = {}
+
+    def _select(self, table, order="rowid"):
+        keys, cols = TABLES[table]
+        cur = self.conn.execute(f"SELECT {', '.join(cols)} FROM {table} ORDER BY {order}")
+        rows = {tuple(row[:len(keys)]): tuple(row) for row in cur}
+        self._snapshot[table] = dict(rows)
+        return list(rows.values())
+
+    def read(self, name, path, default):
+        if name not in RESOURCE_TABLES:
+            return self.fallback.read(name, path, default)
+
+        if name == "players":
+            return {uid: json.loads(data) for uid, _, data in self._select("players")}
+        if name == "scores":
+            return {uid: score for uid, score in self._select("scores")}
+        if name == "reports":
+            blocks = {vid: {**json.loads(data), "reports": []} for vid, data in self._select("report_victims")}
+            for vid, _, _, data in self._select("reports", order="victim_id, report_index"):
+                blocks.setdefault(vid, {"reports": []})["reports"].append(json.loads(data))
+            return blocks
+        if name == "cases":
+            cases = [json.loads(data) for *_, data in self._select("cases")]
+            attempts = {}
+            for cid, _, _, data in self._select("case_attempts", order="case_id, attempt_index"):
+                attempts.setdefault(cid, []).append(json.loads(data))
+            for case in cases:
+                if str(case.get("case_id")) in attempts:
+                    case["attempts"] = attempts[str(case.get("case_id"))]
+            return cases
+
+    def write(self, name, path, data):
+        if name not in RESOURCE_TABLES:
+            return self.fallback.write(name, path, data)
+
+        # база могла ещё не читаться (импорт) — берём её текущее содержимое
+        if any(t not in self._snapshot for t in RESOURCE_TABLES[name]):
+            self.read(name, path, None)
+
+        new_rows = TO_ROWS[name](data)
+        with self.conn:
+            for table, rows in new_rows.items():
+                self._sync(table, rows)
+
+    def prepare(self, name, path, data):
+        """Для store.sync: таблицы пишутся сразу (только изменённые строки), прочее — как у fallback."""
+        if name not in RESOURCE_TABLES:
+            return self.fallback.prepare(name, path, data)
+        self.write(name, path, data)
+        return None
+
+    def _sync(self, table, rows):
+        keys, cols = TABLES[table]
+        old = self._snapshot.get(table, {})
+
+        removed = [k for k in old if k not in rows]
+        changed = [row for k, row in rows.items() if old.get(k) != row]
+
+        if removed:
+            where = " AND ".join(f"{k} = ?" for k in keys)
+            self.conn.executemany(f"DELETE FROM {table} WHERE {where}", removed)
+        if changed:
+            updates = ", ".join(f"{c} = excluded.{c}" for c in cols if c not in keys)
+            self.conn.executemany(
+                f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)}) "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}",
+                changed
+            )
+        self._snapshot[table] = dict(rows)
+
+    def close(self):
+        self.conn.close()
+
+
+def import_json(db_path="ritual.db"):
+    """Разово перенести players/scores/отчёты/pending/дела из JSON-файлов в SQLite."""
+    from store import RESOURCES, JsonBackend
+    from pending_store import LOG_FILE, LEGACY_FILE, JsonlLog, SqliteLog, read_legacy_json
+
+    source = JsonBackend()
+    backend = SqliteBackend(db_path)
+    try:
+        for name in RESOURCE_TABLES:
+            path, default = RESOURCES[name]
+            data = source.read(name, path, default)
+            backend.write(name, path, data)
+            print(f"[sqlite] {path} → {db_path}: {len(data)} записей")
+
+        pending = JsonlLog(LOG_FILE).load() or read_legacy_json(LEGACY_FILE)
+        SqliteLog(backend.conn).rewrite(pending)
+        print(f"[sqlite] ожидающие отчёты → {db_path}: {len(pending)} записей")
+    finally:
+        backend.close()
+
+
+if __name__ == "__main__":
+    import_json(sys.argv[1] if len(sys.argv) > 1 else "ritual.db")
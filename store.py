@@ -0,0 +1,255 @@
+# store.py
+"""
+Общее состояние игры в памяти процесса.
+
+Каждый ресурс читается один раз (при старте или при первом обращении),
+дальше чтения идут из памяти, а изменения сбрасываются на диск в фоне:
+все save одного ресурса в пределах STORE_COALESCE_WINDOW (сек) сливаются в
+одну запись, а JSON-файлы пишутся атомарно (временный файл + rename), так что
+читатель никогда не увидит обрезанный файл.
+
+Снимок ресурса (json.dumps) делается в цикле событий — объекты живые, их
+меняют хендлеры, — а запись файла и fsync уходят в поток (run_in_executor).
+Сбросы идут строго по очереди, так что старый снимок не перепишет новый.
+SQLite пишет прямо в цикле: только изменённые строки, WAL и synchronous=NORMAL,
+без fsync на каждый коммит — это дешевле, чем переносить соединение в поток.
+
+Где лежат данные, решает переменная окружения STORAGE_BACKEND:
+  - json (по умолчанию) — как раньше, отдельные *.json рядом с ботом;
+  - sqlite — база STORAGE_DB (по умолчанию ritual.db), см. storage_sqlite.py.
+
+Последовательности «прочитал → изменил → сохранил», между которыми есть await,
+оборачиваются в `async with store.locked("scores", ...)`: у каждого ресурса свой
+asyncio.Lock, так что блокируется только нужный файл, а не весь диспетчер.
+Замки можно брать и по именам, у которых нет файла здесь (например, "pending" —
+отчёты на модерации живут в pending_store.py).
+"""
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def _coalesce_window():
+    # не константа модуля: .env подгружается уже после импорта
+    return float(os.getenv("STORE_COALESCE_WINDOW", "0.5"))
+
+
+# имя ресурса -> (файл, фабрика значения по умолчанию)
+RESOURCES = {
+    "players": (Path("players.json"), dict),
+    "scores": (Path("scores.json"), dict),
+    "reports": (Path("ritual_reports.json"), dict),
+    "event": (Path("current_event.json"), lambda: None),
+    "cases": (Path("fbi_cases.json"), list),
+    "file_ids": (Path("photo_file_ids.json"), dict),
+}
+
+
+def _dump_json(data):
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+def write_text_atomic(path, text):
+    """Записать текст во временный файл рядом, fsync и переименовать его на место."""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def write_json_atomic(path, data):
+    """Записать JSON во временный файл рядом и переименовать его на место."""
+    write_text_atomic(path, _dump_json(data))
+
+
+class JsonBackend:
+    """Каждый ресурс — отдельный JSON-файл."""
+
+    def read(self, name, path, default):
+        if not path.exists():
+            return default()
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"[store] ⚠️ Ошибка чтения {path}: {e}")
+            return default()
+        empty = default()
+        if empty is not None and not isinstance(data, type(empty)):
+            print(f"[store] ⚠️ Неожиданный формат {path}, беру пустое значение")
+            return empty
+        return data
+
+    def write(self, name, path, data):
+        write_json_atomic(path, data)
+
+    def prepare(self, name, path, data):
+        """Снять снимок сейчас; вернуть запись на диск, которую можно делать в потоке."""
+        return functools.partial(write_text_atomic, path, _dump_json(data))
+
+
+def make_backend():
+    kind = os.getenv("STORAGE_BACKEND", "json").strip().lower()
+    if kind == "sqlite":
+        from storage_sqlite import SqliteBackend
+        return SqliteBackend(os.getenv("STORAGE_DB", "ritual.db"), fallback=JsonBackend())
+    return JsonBackend()
+
+
+class StateStore:
+    def __init__(self, resources, backend=None):
+        self._resources = dict(resources)
+        self._backend = backend
+        self._data = {}
+        self._dirty = set()
+        self._loop = None
+        self._flush_handle = None
+        self._flush_task = None
+        self._flush_lock = asyncio.Lock()
+        self._locks = {}
+
+    @property
+    def backend(self):
+        # выбираем лениво: .env подгружается уже после импорта модулей
+        if self._backend is None:
+            self._backend = make_backend()
+        return self._backend
+
+    def _read(self, name):
+        path, default = self._resources[name]
+        return self.backend.read(name, path, default)
+
+    def _write(self, name):
+        path, _ = self._resources[name]
+        data = self._data.get(name)
+        if data is None:
+            return
+        self.backend.write(name, path, data)
+
+    def get(self, name):
+        """Вернуть живой объект ресурса. После изменения — обязательно set()."""
+        if name not in self._data:
+            self._data[name] = self._read(name)
+        return self._data[name]
+
+    def set(self, name, data):
+        self._data[name] = data
+        self._dirty.add(name)
+        # без фонового сброса (скрипты, тесты) пишем сразу
+        if self._loop is None:
+            self.flush()
+            return
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        # первый save открывает окно, остальные в него просто попадают
+        if self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(_coalesce_window(), self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.ensure_future(self._background_flush())
+
+    async def _background_flush(self):
+        await self.sync()
+        if self._dirty and self._loop is not None:
+            # что-то не записалось — попробуем в следующем окне
+            self._schedule_flush()
+
+    async def sync(self, *names):
+        """
+        Дождаться, пока изменения ресурсов names (по умолчанию — всех) окажутся
+        на диске. Запись файлов — в потоке, цикл событий не блокируется.
+        False — что-то записать не удалось (оно останется на следующий сброс).
+        """
+        ok = True
+        async with self._flush_lock:
+            todo = [n for n in list(self._dirty) if not names or n in names]
+            for name in todo:
+                self._dirty.discard(name)
+                try:
+                    write = self._prepare(name)
+                    if write is not None:
+                        await asyncio.get_running_loop().run_in_executor(None, write)
+                except Exception as e:
+                    self._dirty.add(name)
+                    ok = False
+                    print(f"[store] ❌ Не удалось сохранить {name}: {e}")
+        return ok
+
+    def _prepare(self, name):
+        path, _ = self._resources[name]
+        data = self._data.get(name)
+        if data is None:
+            return None
+        return self.backend.prepare(name, path, data)
+
+    def _lock(self, name):
+        if name not in self._locks:
+            self._locks[name] = asyncio.Lock()
+        return self._locks[name]
+
+    @contextlib.asynccontextmanager
+    async def locked(self, *names):
+        """
+        Захватить замки ресурсов. Порядок всегда как в RESOURCES (прочие имена —
+        следом, по алфавиту) — без взаимоблокировок.
+        """
+        order = [n for n in self._resources if n in names]
+        order += sorted(set(names) - set(order))
+        acquired = []
+        try:
+            for name in order:
+                await self._lock(name).acquire()
+                acquired.append(name)
+            yield
+        finally:
+            for name in reversed(acquired):
+                self._lock(name).release()
+
+    def preload(self):
+        for name in self._resources:
+            self.get(name)
+
+    def flush(self):
+        for name in list(self._dirty):
+            self._dirty.discard(name)
+            try:
+                self._write(name)
+            except Exception as e:
+                self._dirty.add(name)
+                print(f"[store] ❌ Не удалось сохранить {name}: {e}")
+
+    def start(self):
+        """Загрузить всё в память и включить отложенный сброс (из on_startup)."""
+        self.preload()
+        self._loop = asyncio.get_running_loop()
+
+    async def stop(self):
+        """Выключить отложенный сброс и дописать всё, что не успело уйти на диск."""
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._loop = None
+        await self.sync()
+        self.flush()  # последняя попытка для того, что не записалось
+        close = getattr(self._backend, "close", None)
+        if close:
+            close()
+
+
+store = StateStore(RESOURCES)
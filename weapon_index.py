@@ -0,0 +1,53 @@
+# weapon_index.py
+"""
+Индекс оружия из data/weapons.json.
+
+Вместо перечитывания файла и линейного поиска на каждую заявку держим в памяти:
+  нормализованный ID → оружие,
+  название оружия → множество нормализованных ID.
+Индекс перестраивается, только когда у файла меняется mtime.
+"""
+import json
+from pathlib import Path
+
+
+class WeaponIndex:
+    def __init__(self, path, normalize):
+        self.path = Path(path)
+        self.normalize = normalize
+        self._mtime = None
+        self._weapons = []
+        self._by_id = {}
+        self._ids_by_name = {}
+
+    def _refresh(self):
+        mtime = self.path.stat().st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with open(self.path, encoding="utf-8") as f:
+            weapons = json.load(f)
+
+        by_id, ids_by_name = {}, {}
+        for w in weapons:
+            ids = frozenset(self.normalize(x) for x in w.get("ids", []) if isinstance(x, str))
+            ids_by_name[w.get("name")] = ids
+            for wid in ids:
+                by_id.setdefault(wid, w)
+
+        self._weapons, self._by_id, self._ids_by_name = weapons, by_id, ids_by_name
+        self._mtime = mtime
+        print(f"[weapons] Индекс оружия перестроен: {len(weapons)} шт., {len(by_id)} ID")
+
+    def weapons(self):
+        self._refresh()
+        return self._weapons
+
+    def by_id(self, weapon_id):
+        """Оружие по ID (в любой раскладке) или None."""
+        self._refresh()
+        return self._by_id.get(self.normalize(weapon_id or ""))
+
+    def ids_for(self, name):
+        """Нормализованные ID оружия с таким названием; None — такого оружия нет."""
+        self._refresh()
+        return self._ids_by_name.get(name)
@@ -0,0 +1,69 @@
+# webhook_mode.py
+"""
+Приём апдейтов через вебхук (BOT_MODE=webhook) вместо long polling.
+
+Бот поднимает свой aiohttp-сервер (WEBAPP_HOST:WEBAPP_PORT), Telegram шлёт
+апдейты POST-запросами на WEBHOOK_URL + путь. Путь содержит секрет, а каждый
+запрос дополнительно проверяется по заголовку X-Telegram-Bot-Api-Secret-Token —
+чужие запросы получают 403, не доходя до диспетчера.
+
+Несколько процессов можно поставить за один reverse proxy: секрет у всех
+общий (WEBHOOK_SECRET), а регистрирует вебхук в Telegram только тот, у кого
+WEBHOOK_REGISTER=1 (по умолчанию — каждый).
+
+Настройки:
+  WEBHOOK_URL      — внешний адрес без пути, например https://bot.example.com;
+  WEBHOOK_SECRET   — секрет пути и заголовка (A-Z, a-z, 0-9, _ и -),
+                     обязателен: он должен совпадать у всех процессов и
+                     переживать рестарт, иначе Telegram шлёт на старый путь;
+  WEBHOOK_REGISTER — регистрировать ли вебхук при старте (1/0);
+  WEBAPP_HOST, WEBAPP_PORT — где слушать (по умолчанию 0.0.0.0:8080).
+"""
+import hmac
+import os
+
+from aiohttp import web
+
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1") == "1"
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+
+WEBHOOK_PATH = f"/webhook/{WEBHOOK_SECRET}"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def is_webhook():
+    return BOT_MODE == "webhook"
+
+
+@web.middleware
+async def _check_secret(request, handler):
+    token = request.headers.get(SECRET_HEADER, "")
+    if request.path != WEBHOOK_PATH or not hmac.compare_digest(token, WEBHOOK_SECRET):
+        print(f"[webhook] ⛔ Отклонён запрос {request.method} {request.remote}")
+        raise web.HTTPForbidden()
+    return await handler(request)
+
+
+def make_app():
+    """aiohttp-приложение с проверкой секрета; маршрут добавит executor.start_webhook."""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("BOT_MODE=webhook, но не задан WEBHOOK_SECRET")
+    return web.Application(middlewares=[_check_secret])
+
+
+async def register(bot, allowed_updates):
+    """Из on_startup: сообщить Telegram адрес вебхука (если этому процессу положено)."""
+    if not WEBHOOK_REGISTER:
+        return
+    if not WEBHOOK_URL:
+        raise RuntimeError("BOT_MODE=webhook, но не задан WEBHOOK_URL")
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        allowed_updates=allowed_updates,
+        secret_token=WEBHOOK_SECRET,
+    )
+    print(f"[webhook] Вебхук зарегистрирован: {WEBHOOK_URL}/webhook/…")